@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+Benchmarks of rule evaluation and queryset generation, run on in-memory SQLite
+with synthetic users, articles and rule sets of increasing size. Results are
+printed as JSON, so that they can be compared across commits:
+
+    python benchmarks/run.py > before.json
+    python benchmarks/run.py --sizes 1 10 100 --rows 100 1000 > after.json
+
+Each result is the best time of a single call, in seconds.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import django
+from django.conf import settings
+
+settings.configure(
+    DEBUG=False,
+    SECRET_KEY="benchmarks",
+    INSTALLED_APPS=[
+        "django.contrib.auth",
+        "django.contrib.contenttypes",
+        "cancan",
+        "cancan.testapp",
+    ],
+    DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+    TEMPLATES=[{"BACKEND": "django.template.backends.django.DjangoTemplates"}],
+    CANCAN={"ABILITIES": "__main__.declare_abilities"},
+    DEFAULT_AUTO_FIELD="django.db.models.AutoField",
+)
+django.setup()
+
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory
+from cancan.ability import Ability
+from cancan.access_rules import AccessRules
+from cancan.middleware import CanCanMiddleware
+from cancan.testapp.models import Article, User
+
+# number of rules declared by `declare_abilities`, changed for each rule set size
+RULES = 1
+
+
+def declare_rules(user, rules, size):
+    """
+    Declares `size` rules decidable in memory, and one that needs SQL
+    """
+    rules.allow("view", Article, is_published=True)
+    rules.allow("view", Article, created_by=user)
+    for i in range(size):
+        rules.allow("view", Article, name=f"article-{i}")
+    rules.allow("change", Article, name__startswith="article-1")
+    rules.deny("change", Article, is_published=True)
+
+
+def declare_abilities(user, rules):
+    declare_rules(user, rules, RULES)
+
+
+def create_data(users, rows):
+    User.objects.bulk_create(User(username=f"user-{i}") for i in range(users))
+    users = list(User.objects.all())
+    Article.objects.bulk_create(
+        Article(
+            name=f"article-{i}",
+            is_published=i % 3 == 0,
+            created_by=users[i % len(users)],
+        )
+        for i in range(rows)
+    )
+
+
+def best(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def make_ability(user, size):
+    access_rules = AccessRules(user)
+    declare_rules(user, access_rules, size)
+    return Ability(access_rules)
+
+
+def bench_rules(user, size):
+    ability = make_ability(user, size)
+    article = Article.objects.filter(is_published=False).exclude(created_by=user)[0]
+    # cache_size=0 measures evaluation of rules, not the cache of results
+    uncached = Ability(ability.access_rules, in_memory=True, cache_size=0)
+    sql = Ability(ability.access_rules, in_memory=False, cache_size=0)
+    qs = ability.queryset_for("view", Article)
+    return {
+        "declare": best(lambda: make_ability(user, size), 100),
+        "can_class": best(lambda: ability.can("view", Article), 10000),
+        "can_instance_cached": best(lambda: ability.can("view", article), 10000),
+        "can_instance_memory": best(lambda: uncached.can("view", article), 1000),
+        "can_instance_sql": best(lambda: sql.can("view", article), 100),
+        "can_instance_fallback": best(lambda: uncached.can("change", article), 100),
+        "queryset_build": best(
+            lambda: str(ability.queryset_for("view", Article).query), 100
+        ),
+        "queryset_execute": best(lambda: list(qs.all()), 10),
+    }
+
+
+def bench_template(user, size, rows):
+    ability = make_ability(user, size)
+    objects = list(Article.objects.all()[:rows])
+    check = Template(
+        "{% load cancan_tags %}{% for a in object_list %}"
+        '{% if ability|can:"change"|subject:a %}x{% endif %}{% endfor %}'
+    )
+    prefetch = Template(
+        '{% load cancan_tags %}{% prefetch_abilities object_list "change" %}'
+        "{% for a in object_list %}"
+        '{% if ability|can:"change"|subject:a %}x{% endif %}{% endfor %}'
+    )
+
+    def render(template):
+        ability.invalidate()
+        template.render(Context({"ability": ability, "object_list": objects}))
+
+    return {
+        "template_can": best(lambda: render(check), 3),
+        "template_prefetch": best(lambda: render(prefetch), 3),
+    }
+
+
+def bench_middleware(user):
+    request_factory = RequestFactory()
+
+    def get_response(request):
+        request.ability.can("view", Article)
+        return HttpResponse()
+
+    middleware = CanCanMiddleware(get_response)
+
+    def without_middleware():
+        request = request_factory.get("/")
+        request.user = user
+        request.ability = make_ability(user, RULES)
+        get_response(request)
+
+    def with_middleware():
+        request = request_factory.get("/")
+        request.user = user
+        middleware(request)
+
+    return {
+        "request_baseline": best(without_middleware, 100),
+        "request_middleware": best(with_middleware, 100),
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    global RULES
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--users", type=int, default=10)
+    args = parser.parse_args()
+
+    call_command("migrate", verbosity=0)
+    create_data(args.users, max(args.rows))
+    user = User.objects.first()
+
+    results = []
+    for size in args.sizes:
+        RULES = size
+        for name, seconds in bench_rules(user, size).items():
+            results.append({"name": name, "rules": size, "seconds": seconds})
+        for rows in args.rows:
+            for name, seconds in bench_template(user, size, rows).items():
+                results.append(
+                    {"name": name, "rules": size, "rows": rows, "seconds": seconds}
+                )
+        for name, seconds in bench_middleware(user).items():
+            results.append({"name": name, "rules": size, "seconds": seconds})
+
+    output = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "results": results,
+    }
+    json.dump(output, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
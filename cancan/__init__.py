@@ -0,0 +1,5 @@
+import django
+from .registry import rules_for
+
+if django.VERSION < (3, 2):
+    default_app_config = "cancan.apps.CanCanConfig"
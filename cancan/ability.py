@@ -1,98 +1,428 @@
 import inspect
+import logging
+from collections import Counter, OrderedDict, namedtuple
 from django.apps import apps
+from django.db.models import (
+    BooleanField,
+    Case,
+    Exists,
+    OuterRef,
+    Prefetch,
+    Q,
+    Value,
+    When,
+)
+from django.db.models.constants import LOOKUP_SEP
 from .access_rules import AccessRules, normalize_subject
+from .compiler import rules_to_deny_q, rules_to_q
+from .evaluator import evaluate
+
+logger = logging.getLogger(__name__)
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+def get_related_model(model, lookup):
+    """
+    Returns the model at the end of a prefetch_related lookup, i.e. "issue_set"
+    """
+    for part in lookup.split(LOOKUP_SEP):
+        for field in model._meta.get_fields():
+            if not field.is_relation:
+                continue
+            if field.name == part or (
+                not field.concrete and field.get_accessor_name() == part
+            ):
+                model = field.related_model
+                break
+        else:
+            raise ValueError(f"{part!r} is not a relation of {model.__name__}")
+    return model
 
 
 class Ability:
-    def __init__(self, access_rules: AccessRules):
+    # see cancan.stats.InstrumentedAbility
+    stats = None
+
+    def __init__(
+        self,
+        access_rules: AccessRules,
+        in_memory=False,
+        cache_size=1024,
+        warn_repeated=None,
+    ):
         self.access_rules = access_rules
+        # when enabled, object checks are evaluated against instance attributes
+        # and the database is queried only when this is not conclusive
+        self.in_memory = in_memory
+        # how many object checks were decided in "python" and in "sql"
+        self.check_paths = Counter()
+        # results of object checks, keyed by (action, model, pk)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        # results of can_many, which are not evicted, so that prefetching for
+        # lists larger than cache_size does not fall back to a query per object
+        self._prefetched = {}
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_rules_version = access_rules.version
+        # development mode, a warning is logged when objects of the same model are
+        # checked in SQL this many times, which suggests using can_many or prefetching
+        self.warn_repeated = warn_repeated
+        self._repeated_checks = Counter()
 
     def validate_model(self, action, model):
-        can_count = 0
-        cannot_count = 0
-        model_abilities = filter(
-            lambda c: c["subject"] == model and c["action"] == action,
-            self.access_rules.rules,
-        )
-        for c in model_abilities:
-            if c["type"] == "can":
-                can_count += 1
-            if c["type"] == "cannot":
-                cannot_count += 1
-
-        if cannot_count > 0:
-            return False
-        if can_count == 0:
+        bucket = self.access_rules.compile(action, model)
+        if bucket.denies_all:
             return False
-        return True
+        # conditional cannot-type rules restrict only some of the objects
+        return len(bucket.can) > 0
 
     def validate_instance(self, action, instance):
+        result = self._instance_check(action, instance)
+        if isinstance(result, bool):
+            return result
+        return result.exists()
+
+    async def avalidate_instance(self, action, instance):
+        result = self._instance_check(action, instance)
+        if isinstance(result, bool):
+            return result
+        return await result.aexists()
+
+    def _instance_check(self, action, instance):
+        """
+        Returns the result of an object check if it can be decided without a database,
+        otherwise a queryset that is not empty when the check passes.
+        The queryset filters by pk first, followed by conditions of all rules OR'ed together.
+        """
         model = instance._meta.model
-        model_abilities = filter(
-            lambda c: c["subject"] == model and c["action"] == action,
-            self.access_rules.rules,
-        )
+        bucket = self.access_rules.compile(action, model)
 
-        query_sets = []
-        for c in model_abilities:
-            if c["type"] == "can":
-                qs = model.objects.all().filter(
-                    pk=instance.id, **c.get("conditions", {})
-                )
+        if instance.pk is None:
+            return False
 
-            if c["type"] == "cannot":
-                raise NotImplementedError("cannot-type rules are not yet implemented")
+        matched, q = self._decide(model, bucket, instance)
+        if matched is not None:
+            self._report_path("python", action, instance)
+            return matched
 
-            query_sets.append(qs)
+        self._report_path("sql", action, instance)
+        if self.warn_repeated is not None:
+            self._track_repeated(action, model)
+        return model._default_manager.filter(pk=instance.pk).filter(q)
 
-        if len(query_sets) == 0:
-            return False
+    def _decide(self, model, bucket, instance):
+        """
+        Evaluates rules against instance attributes. Returns True or False when this is
+        conclusive, otherwise None and a Q object that needs to be checked in SQL.
+        """
+        denied, undecided_denies = self._evaluate(bucket.cannot, instance)
+        if denied:
+            return False, None
+        allowed, undecided_allows = self._evaluate(bucket.can, instance)
+        if allowed is False:
+            return False, None
+        if allowed and denied is False:
+            return True, None
+        q = Q() if allowed else rules_to_q(undecided_allows)
+        return None, q & rules_to_deny_q(model, undecided_denies)
+
+    def _evaluate(self, rules, instance):
+        """
+        Checks if any of the rules matches instance attributes. Returns True or False when
+        this is conclusive, otherwise None and rules that need to be checked in SQL.
+        """
+        undecided = []
+        for rule in rules:
+            if len(rule.conditions) == 0:
+                # unconditional rule
+                return True, []
+            matched = evaluate(instance, rule.conditions) if self.in_memory else None
+            if matched:
+                return True, []
+            if matched is None:
+                undecided.append(rule)
+        if len(undecided) == 0:
+            return False, []
+        return None, undecided
+
+    def _track_repeated(self, action, model):
+        key = (action, model)
+        self._repeated_checks[key] += 1
+        if self._repeated_checks[key] == self.warn_repeated:
+            from .testing import get_call_site
 
-        can_query_set = query_sets.pop()
-        for qs in query_sets:
-            can_query_set |= qs
+            logger.warning(
+                "%s check for %s objects was queried %d times, consider using "
+                "can_many or prefetch_abilities. Called from %s",
+                action,
+                model._meta.label,
+                self.warn_repeated,
+                get_call_site(),
+            )
 
-        return can_query_set.count() > 0
+    def _report_path(self, path, action, instance):
+        self.check_paths[path] += 1
+        logger.debug("%s check for %r decided in %s", action, instance, path)
 
     def can(self, action, subject) -> bool:
         subject = normalize_subject(subject)
-        action = self.access_rules.alias_to_action(action)
         if inspect.isclass(subject):
             return self.validate_model(action, subject)
+
+        key = self._cache_key(action, subject._meta.model, subject.pk)
+        result = self._get_cached(key)
+        if result is None:
+            result = self.validate_instance(action, subject)
+            self._set_cached(key, result)
+        return result
+
+    async def acan(self, action, subject) -> bool:
+        subject = normalize_subject(subject)
+        if inspect.isclass(subject):
+            await self.access_rules.aload(subject)
+            return self.validate_model(action, subject)
+        await self.access_rules.aload(subject._meta.model)
+
+        key = self._cache_key(action, subject._meta.model, subject.pk)
+        result = self._get_cached(key)
+        if result is None:
+            result = await self.avalidate_instance(action, subject)
+            self._set_cached(key, result)
+        return result
+
+    def can_many(self, action, objects):
+        """
+        Checks an ability for many objects of the same model, using at most one query.
+        Returns a dict mapping object pk to the result, which is also kept until
+        invalidated, regardless of cache_size, so that subsequent `can` calls for
+        these objects do not hit the database.
+        """
+        model, results, query_set = self._many_check(action, objects)
+        if query_set is not None:
+            allowed = set(query_set.values_list("pk", flat=True))
+            self._set_many_results(action, model, results, allowed)
+        return results
+
+    async def acan_many(self, action, objects):
+        objects = list(objects)
+        if objects:
+            await self.access_rules.aload(objects[0]._meta.model)
+        model, results, query_set = self._many_check(action, objects)
+        if query_set is not None:
+            allowed = {pk async for pk in query_set.values_list("pk", flat=True)}
+            self._set_many_results(action, model, results, allowed)
+        return results
+
+    def _many_check(self, action, objects):
+        """
+        Returns results of checks which can be decided without a database (None for
+        the others) and a queryset of allowed objects among the undecided ones.
+        """
+        objects = [obj for obj in objects if obj.pk is not None]
+        if len(objects) == 0:
+            return None, {}, None
+
+        model = objects[0]._meta.model
+        bucket = self.access_rules.compile(action, model)
+
+        results = {}
+        unresolved = []
+        for obj in objects:
+            if obj._meta.model is not model:
+                raise ValueError("can_many requires objects of the same model")
+            key = self._cache_key(action, model, obj.pk)
+            result = self._get_cached(key)
+            if result is None:
+                result, q = self._decide(model, bucket, obj)
+                if result is None:
+                    unresolved.append(obj.pk)
+                else:
+                    self._report_path("python", action, obj)
+            if result is not None and key is not None:
+                self._prefetched[key] = result
+            results[obj.pk] = result
+
+        if len(unresolved) == 0:
+            return model, results, None
+
+        self._report_path("sql", action, model)
+        query_set = self.queryset_for(action, model, distinct=False).filter(
+            pk__in=unresolved
+        )
+        return model, results, query_set
+
+    def _set_many_results(self, action, model, results, allowed):
+        for pk, result in results.items():
+            if result is None:
+                results[pk] = pk in allowed
+                key = self._cache_key(action, model, pk)
+                if key is not None:
+                    self._prefetched[key] = results[pk]
+
+    def _cache_key(self, action, model, pk):
+        if pk is None or not self.cache_size:
+            return None
+        self._check_cache_version()
+        return (action, model, pk)
+
+    def _get_cached(self, key):
+        if key is None:
+            return None
+        result = self._cache.get(key)
+        if result is not None:
+            self._cache.move_to_end(key)
+        else:
+            result = self._prefetched.get(key)
+        if result is None:
+            self._cache_misses += 1
         else:
-            return self.validate_instance(action, subject)
+            self._cache_hits += 1
+        return result
 
-    def queryset_for(self, action, model, distinct=True):
-        model = normalize_subject(model)
-        action = self.access_rules.alias_to_action(action)
+    def _set_cached(self, key, result):
+        if key is None:
+            return
+        self._cache[key] = result
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
 
-        model_abilities = filter(
-            lambda c: c["subject"] == model and c["action"] == action,
-            self.access_rules.rules,
+    def _check_cache_version(self):
+        if self._cache_rules_version != self.access_rules.version:
+            # rules or aliases were changed since the results were cached
+            self.invalidate()
+            self._cache_rules_version = self.access_rules.version
+
+    def invalidate(self, subject=None):
+        """
+        Forgets cached results of object checks, i.e. after an object was modified.
+        Accepts an instance, a model (all its instances) or nothing (everything).
+        """
+        if subject is None:
+            self._cache.clear()
+            self._prefetched.clear()
+            return
+
+        subject = normalize_subject(subject)
+        for store in (self._cache, self._prefetched):
+            if inspect.isclass(subject):
+                stale = [key for key in store if key[1] is subject]
+            else:
+                model, pk = subject._meta.model, subject.pk
+                stale = [key for key in store if key[1] is model and key[2] == pk]
+            for key in stale:
+                del store[key]
+
+    def cache_info(self):
+        return CacheInfo(
+            self._cache_hits, self._cache_misses, self.cache_size, len(self._cache)
         )
 
-        query_sets = []
-        for c in model_abilities:
-            if c["type"] == "can" and "conditions" in c:
-                qs = model.objects.all().filter(**c.get("conditions", {}))
+    def queryset_for(self, action, model, distinct=None):
+        """
+        Returns a queryset of all objects of a model, for which the action is allowed.
+        Conditions of all rules are OR'ed in a single filter. By default DISTINCT is
+        applied only when a condition spans a multi-valued relation (many-to-many or
+        reverse foreign key), pass distinct=True/False to force it.
+        """
+        model = normalize_subject(model)
+        return self.filter(action, model._default_manager.all(), distinct)
 
-            if c["type"] == "cannot":
-                raise NotImplementedError("cannot-type rules are not yet implemented")
+    def filter(self, action, queryset, distinct=None):
+        """
+        Same as `queryset_for`, but narrows down an existing queryset
+        """
+        model = queryset.model
+        bucket = self.access_rules.compile(action, model)
 
-            query_sets.append(qs)
+        q = bucket.q
+        if q is None:
+            return queryset.none()
 
-        if len(query_sets) == 0:
-            return model.objects.none()
+        if len(q) == 0:
+            # an unconditional rule allows everything, other rules are redundant
+            return queryset.distinct() if distinct else queryset
 
-        can_query_set = query_sets.pop()
-        for qs in query_sets:
-            can_query_set |= qs
+        can_query_set = queryset.filter(q)
 
+        if distinct is None:
+            # cannot-type rules never join multi-valued relations
+            distinct = bucket.distinct
         if distinct:
             can_query_set = can_query_set.distinct()
 
         return can_query_set
 
+    async def aqueryset_for(self, action, model, distinct=None):
+        # building a queryset does not hit the database, unlike declaring rules on demand
+        model = normalize_subject(model)
+        await self.access_rules.aload(model)
+        return self.queryset_for(action, model, distinct)
+
+    def prefetch(self, queryset, lookup, action="view", to_attr=None):
+        """
+        Prefetches related objects, limited to those for which the action is allowed, i. e.
+        ability.prefetch(Project.objects.all(), "issue_set", action="view")
+        Each level of a nested lookup, i.e. "issue_set__comment_set", is limited as well.
+        """
+        model = queryset.model
+        parts = lookup.split(LOOKUP_SEP)
+        prefetches = []
+        for i, part in enumerate(parts, start=1):
+            model = get_related_model(model, part)
+            prefetches.append(
+                Prefetch(
+                    LOOKUP_SEP.join(parts[:i]),
+                    queryset=self.queryset_for(action, model),
+                    to_attr=to_attr if i == len(parts) else None,
+                )
+            )
+        return queryset.prefetch_related(*prefetches)
+
+    def get_prefetch(self, model, lookup, action="view", to_attr=None):
+        """
+        Returns a Prefetch object for related objects, limited to those for which
+        the action is allowed. Use `prefetch` for nested lookups.
+        """
+        if LOOKUP_SEP in lookup:
+            raise ValueError(
+                f"get_prefetch does not limit intermediate levels of {lookup!r}, "
+                "use ability.prefetch instead"
+            )
+        related_model = get_related_model(normalize_subject(model), lookup)
+        return Prefetch(
+            lookup, queryset=self.queryset_for(action, related_model), to_attr=to_attr
+        )
+
+    def annotate(self, queryset, **actions):
+        """
+        Adds boolean columns with abilities to each row of a queryset, i. e.
+        ability.annotate(Article.objects.all(), change="can_change", delete="can_delete")
+        """
+        model = queryset.model
+        annotations = {}
+        for action, name in actions.items():
+            annotations[name] = self._ability_expression(action, model)
+        return queryset.annotate(**annotations)
+
+    def _ability_expression(self, action, model):
+        bucket = self.access_rules.compile(action, model)
+
+        q = bucket.q
+        if q is None:
+            return Value(False, output_field=BooleanField())
+        if len(q) == 0:
+            return Value(True, output_field=BooleanField())
+        if bucket.distinct:
+            # joining a multi-valued relation would duplicate rows
+            return Exists(model._default_manager.filter(q, pk=OuterRef("pk")))
+        return Case(
+            When(q, then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField(),
+        )
+
     def __contains__(self, item):
         action, subject = item
         return self.can(action, subject)
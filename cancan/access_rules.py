@@ -1,21 +1,130 @@
+import warnings
+from asgiref.sync import sync_to_async
 from django.apps import apps
+from .compiler import EMPTY_COMPILED_BUCKET, compile_bucket
+
+# "app_label.ModelName" -> model class
+subject_cache = {}
 
 
 def normalize_subject(subject):
-    if isinstance(subject, str):
-        try:
-            app_label, model_name = subject.split(".")
-            return apps.get_model(app_label, model_name)
-        except Exception as e:
-            pass
-    return subject
+    if not isinstance(subject, str):
+        return subject
+    try:
+        return subject_cache[subject]
+    except KeyError:
+        pass
+    try:
+        model = apps.get_model(subject)
+    except ValueError as e:
+        raise LookupError(
+            f"Subject {subject!r} must be a model or a label in 'app_label.ModelName' format"
+        ) from e
+    subject_cache[subject] = model
+    return model
+
+
+def populate_subject_cache():
+    for model in apps.get_models(include_auto_created=True):
+        subject_cache[model._meta.label] = model
+        subject_cache[model._meta.label_lower] = model
+
+
+def clear_subject_cache():
+    subject_cache.clear()
+
+
+EMPTY_BUCKET = {"can": (), "cannot": ()}
+
+# model or app label -> functions declaring its rules on demand, see cancan.registry
+lazy_declarations = {}
+
+
+def get_lazy_declarations(subject):
+    if not hasattr(subject, "_meta"):
+        return []
+    return lazy_declarations.get(subject, []) + lazy_declarations.get(
+        subject._meta.app_label, []
+    )
 
 
 class AccessRules:
     def __init__(self, user):
         self.user = user
         self.rules = []
+        # alias -> actions whose rules also apply to the alias
         self.action_aliases = {}
+        # action -> all actions whose rules apply to it, including itself
+        self.implied_actions = {}
+        # (subject, action) -> bucket merged over implied actions
+        self.merged_index = {}
+        # (subject, action) -> compiled merged bucket, see cancan.compiler
+        self.compiled_index = {}
+        # (subject, action) -> {"can": [...], "cannot": [...]}
+        self.index = {}
+        # incremented on every change, so that cached results can be discarded
+        self.version = 0
+        # subjects and functions whose lazy declarations were already run
+        self.loaded_subjects = set()
+        self.loaded_declarations = set()
+        # subjects which received rules from lazy declarations being run, if any
+        self.lazily_declared = None
+
+    def __getstate__(self):
+        # user is not stored when rules are cached, it is restored on load
+        state = self.__dict__.copy()
+        state["user"] = None
+        state["implied_actions"] = {}
+        state["merged_index"] = {}
+        state["compiled_index"] = {}
+        return state
+
+    def _add_rule(self, rule):
+        if self.lazily_declared is None:
+            self.version += 1
+        else:
+            self.lazily_declared.add(rule["subject"])
+        self._clear_indexes()
+        self.rules.append(rule)
+        bucket = self.index.setdefault(
+            (rule["subject"], rule["action"]), {"can": [], "cannot": []}
+        )
+        bucket[rule["type"]].append(rule)
+        return rule
+
+    def _add_buckets(self, buckets, compiled=None):
+        """
+        Adds rules already grouped by subject and action, i.e. by `AbilityPlan.bind`,
+        as a single change. Compiled buckets are used as they are for subjects and
+        actions without other rules, unless aliases or lazy declarations apply.
+        """
+        compiled = compiled or {}
+        if self.lazily_declared is None:
+            self.version += 1
+        else:
+            self.lazily_declared.update(subject for subject, action in buckets)
+        self._clear_indexes()
+        for key, bucket in buckets.items():
+            self.rules.extend(bucket["can"])
+            self.rules.extend(bucket["cannot"])
+            if key not in self.index:
+                self.index[key] = {
+                    "can": list(bucket["can"]),
+                    "cannot": list(bucket["cannot"]),
+                }
+                subject = key[0]
+                if (
+                    key in compiled
+                    and not self.action_aliases
+                    and (
+                        subject in self.loaded_subjects
+                        or not get_lazy_declarations(subject)
+                    )
+                ):
+                    self.compiled_index[key] = compiled[key]
+            else:
+                self.index[key]["can"].extend(bucket["can"])
+                self.index[key]["cannot"].extend(bucket["cannot"])
 
     def allow(self, action, subject, **kwargs):
         rule = {
@@ -24,11 +133,195 @@ class AccessRules:
             "subject": normalize_subject(subject),
             "conditions": kwargs,
         }
-        self.rules.append(rule)
-        return rule
+        return self._add_rule(rule)
 
-    def alias_action(self, action, alias):
-        self.action_aliases[alias] = action
+    def deny(self, action, subject, **kwargs):
+        """
+        Declares a cannot-type rule. Cannot-type rules take precedence over
+        allowed ones, regardless of the order in which they were declared.
+        """
+        rule = {
+            "type": "cannot",
+            "action": action,
+            "subject": normalize_subject(subject),
+            "conditions": kwargs,
+        }
+        return self._add_rule(rule)
+
+    def lookup(self, action, subject):
+        """
+        Returns rules declared for a given action and subject, grouped by rule type,
+        including rules of actions it is an alias of
+        """
+        if lazy_declarations and subject not in self.loaded_subjects:
+            self.load(subject)
+        if not self.action_aliases:
+            return self.index.get((subject, action), EMPTY_BUCKET)
+        key = (subject, action)
+        try:
+            return self.merged_index[key]
+        except KeyError:
+            pass
+        buckets = [
+            self.index[(subject, implied)]
+            for implied in self.get_implied_actions(action)
+            if (subject, implied) in self.index
+        ]
+        if len(buckets) == 0:
+            bucket = EMPTY_BUCKET
+        elif len(buckets) == 1:
+            bucket = buckets[0]
+        else:
+            bucket = {
+                "can": [rule for b in buckets for rule in b["can"]],
+                "cannot": [rule for b in buckets for rule in b["cannot"]],
+            }
+        self.merged_index[key] = bucket
+        return bucket
+
+    def load(self, subject):
+        """
+        Runs functions registered with `rules_for` for a subject, unless already run
+        """
+        # only subjects which were looked up before may have cached results
+        looked_up = set(self.loaded_subjects)
+        self.loaded_subjects.add(subject)
+        outer, self.lazily_declared = self.lazily_declared, set()
+        try:
+            self._run_declarations(get_lazy_declarations(subject))
+        finally:
+            declared, self.lazily_declared = self.lazily_declared, outer
+        if outer is not None:
+            outer.update(declared)
+        elif declared & looked_up:
+            self.version += 1
+
+    async def aload(self, subject):
+        """
+        Same as `load`, but runs functions outside of the event loop, as they may
+        query the database
+        """
+        if subject not in self.loaded_subjects and get_lazy_declarations(subject):
+            await sync_to_async(self.load)(subject)
+
+    def _run_declarations(self, declarations):
+        for declare in declarations:
+            if declare not in self.loaded_declarations:
+                self.loaded_declarations.add(declare)
+                declare(self.user, self)
+
+    def compile(self, action, subject):
+        """
+        Same as `lookup`, but returns rules compiled for use by `Ability`
+        """
+        key = (subject, action)
+        try:
+            return self.compiled_index[key]
+        except KeyError:
+            pass
+        bucket = self.lookup(action, subject)
+        compiled = (
+            compile_bucket(subject, bucket)
+            if bucket is not EMPTY_BUCKET
+            else EMPTY_COMPILED_BUCKET
+        )
+        self.compiled_index[key] = compiled
+        return compiled
+
+    def freeze(self):
+        """
+        Returns an immutable, compiled copy of the rules, which can be shared between
+        threads and pickled. Rules declared with `rules_for` are all loaded first.
+        """
+        for declarations in list(lazy_declarations.values()):
+            self._run_declarations(declarations)
+        subjects = {subject for subject, action in self.index}
+        actions = {action for subject, action in self.index}
+        actions.update(self.action_aliases)
+        buckets = {}
+        for subject in subjects:
+            for action in actions:
+                compiled = self.compile(action, subject)
+                if compiled is not EMPTY_COMPILED_BUCKET:
+                    buckets[(subject, action)] = compiled
+        return FrozenAccessRules(self.user, buckets, self.version)
+
+    def alias_action(self, action, *aliases):
+        """
+        Makes rules declared for an action apply to its aliases as well, i. e.
+        rules.alias_action("manage", "view", "change", "delete")
+        Aliases can be nested, "view" may in turn be an action for "list".
+        """
+        self.version += 1
+        for alias in aliases:
+            self.action_aliases.setdefault(alias, set()).add(action)
+        self.implied_actions.clear()
+        self._clear_indexes()
 
     def alias_to_action(self, alias):
-        return self.action_aliases.get(alias, alias)
+        """
+        Deprecated, rules of all actions returned by `get_implied_actions` apply to an alias.
+        Returns the action an alias was declared for, or the alias itself.
+        """
+        warnings.warn(
+            "alias_to_action() is deprecated, use get_implied_actions() instead",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        implied = self.get_implied_actions(alias)
+        return implied[1] if len(implied) > 1 else alias
+
+    def _clear_indexes(self):
+        self.merged_index.clear()
+        self.compiled_index.clear()
+
+    def get_implied_actions(self, action):
+        """
+        Returns the action and all actions it is an alias of, directly or not
+        """
+        try:
+            return self.implied_actions[action]
+        except KeyError:
+            pass
+        implied = [action]
+        for current in implied:
+            for parent in self.action_aliases.get(current, ()):
+                if parent not in implied:
+                    implied.append(parent)
+        self.implied_actions[action] = implied = tuple(implied)
+        return implied
+
+
+class FrozenAccessRules:
+    """
+    Access rules returned by `AccessRules.freeze()`. Rules can not be declared anymore,
+    checks read compiled buckets directly.
+    """
+
+    __slots__ = ("user", "buckets", "version")
+
+    def __init__(self, user, buckets, version=0):
+        self.user = user
+        # (subject, action) -> CompiledBucket
+        self.buckets = buckets
+        self.version = version
+
+    def __getstate__(self):
+        # user is not stored when rules are cached, it is restored on load
+        return {"user": None, "buckets": self.buckets, "version": self.version}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def lookup(self, action, subject):
+        return self.buckets.get((subject, action), EMPTY_COMPILED_BUCKET)
+
+    compile = lookup
+
+    async def aload(self, subject):
+        # rules declared with `rules_for` were all loaded when frozen
+        pass
+
+    def freeze(self):
+        return self
@@ -1,5 +1,17 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CanCanConfig(AppConfig):
     name = "cancan"
+
+    def ready(self):
+        from . import conf
+        from .access_rules import populate_subject_cache
+        from .cache import connect_rules_invalidation
+
+        populate_subject_cache()
+
+        # changes of these models invalidate cached rules of all users
+        for label in getattr(settings, "CANCAN", {}).get("CACHE_INVALIDATE_ON", []):
+            connect_rules_invalidation(label)
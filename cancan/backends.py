@@ -0,0 +1,71 @@
+from functools import lru_cache
+from django.apps import apps
+from .conf import get_declare_abilities
+from .middleware import build_ability
+
+
+@lru_cache(maxsize=None)
+def parse_perm(perm):
+    """
+    Splits "app_label.action_modelname" permission into action and model
+    """
+    try:
+        app_label, codename = perm.split(".", 1)
+        app_config = apps.get_app_config(app_label)
+    except (ValueError, LookupError):
+        return None
+    models = sorted(
+        app_config.get_models(), key=lambda m: len(m._meta.model_name), reverse=True
+    )
+    for model in models:
+        suffix = "_" + model._meta.model_name
+        if codename.endswith(suffix) and len(codename) > len(suffix):
+            return codename[: -len(suffix)], model
+    return None
+
+
+def get_user_ability(user):
+    """
+    Returns ability of a user, reusing the one created by CanCanMiddleware
+    for the current request, if there is one.
+    """
+    ability = getattr(user, "_cancan_ability", None)
+    if ability is None:
+        ability = build_ability(user, get_declare_abilities())
+        user._cancan_ability = ability
+    return ability
+
+
+class CanCanBackend:
+    """
+    Authentication backend checking permissions with abilities, i.e.
+    user.has_perm("core.change_project", project) is ability.can("change", project)
+    """
+
+    def authenticate(self, request, **kwargs):
+        return None
+
+    def has_perm(self, user_obj, perm, obj=None):
+        if user_obj.is_authenticated and not user_obj.is_active:
+            return False
+        parsed = parse_perm(perm)
+        if parsed is None:
+            return False
+        action, model = parsed
+        ability = get_user_ability(user_obj)
+        if obj is None:
+            return ability.can(action, model)
+        if obj._meta.model is not model:
+            # permission of another model, i.e. "auth.change_user" for an article
+            return False
+        return ability.can(action, obj)
+
+    def has_module_perms(self, user_obj, app_label):
+        if user_obj.is_authenticated and not user_obj.is_active:
+            return False
+        ability = get_user_ability(user_obj)
+        return any(
+            ability.can(action, model)
+            for model in apps.get_app_config(app_label).get_models()
+            for action in model._meta.default_permissions
+        )
@@ -0,0 +1,122 @@
+"""
+Cross-request cache of declared access rules, enabled with CANCAN["CACHE"]
+pointing to one of the caches defined in CACHES setting.
+
+Cached rules are stored per user and per rules version. The version is shared
+by all users and is changed by `bump_rules_version`, i.e. when data used by
+your abilities function changes.
+"""
+
+from uuid import uuid4
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from .access_rules import AccessRules
+
+VERSION_KEY = "cancan:rules_version"
+
+
+def get_cache():
+    alias = getattr(settings, "CANCAN", {}).get("CACHE")
+    if not alias:
+        return None
+    if alias is True:
+        alias = DEFAULT_CACHE_ALIAS
+    return caches[alias]
+
+
+def get_rules_version(cache):
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid4().hex, timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_rules_version(*args, **kwargs):
+    """
+    Invalidates cached rules of all users. Can be connected directly to model signals:
+    post_save.connect(bump_rules_version, sender=Membership)
+    """
+    cache = get_cache()
+    if cache is not None:
+        cache.set(VERSION_KEY, uuid4().hex, timeout=None)
+
+
+def connect_rules_invalidation(label):
+    """
+    Invalidates cached rules when objects of a model are saved or deleted, or when
+    its many-to-many relations change, i.e. groups of "auth.User"
+    """
+    model = apps.get_model(label)
+    uid = f"cancan_bump_rules_version_{label}"
+    post_save.connect(bump_rules_version, sender=model, dispatch_uid=uid)
+    post_delete.connect(bump_rules_version, sender=model, dispatch_uid=uid)
+    # sent with the through model, also when the model itself is one
+    through_models = {model}
+    for field in model._meta.get_fields(include_hidden=True):
+        if field.many_to_many:
+            through = field.remote_field.through if field.concrete else field.through
+            through_models.add(through)
+    for through in through_models:
+        m2m_changed.connect(
+            bump_rules_version,
+            sender=through,
+            dispatch_uid=f"{uid}_{through._meta.label}",
+        )
+
+
+def get_cache_key(cache, user):
+    user_key = user.pk if user.is_authenticated else "anonymous"
+    return f"cancan:rules:{get_rules_version(cache)}:{user_key}"
+
+
+def get_timeout():
+    return settings.CANCAN.get("CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+
+
+def get_access_rules(user, declare_abilities):
+    """
+    Returns access rules of a user, declaring them only if they are not cached
+    """
+    cache = get_cache()
+    if cache is None:
+        access_rules = AccessRules(user)
+        declare_abilities(user, access_rules)
+        return access_rules
+
+    key = get_cache_key(cache, user)
+    access_rules = cache.get(key)
+    if access_rules is not None:
+        access_rules.user = user
+        return access_rules
+
+    access_rules = AccessRules(user)
+    declare_abilities(user, access_rules)
+    cache.set(key, access_rules, timeout=get_timeout())
+    return access_rules
+
+
+async def aget_access_rules(user, declare_abilities):
+    """
+    Same as `get_access_rules`, for coroutine abilities functions
+    """
+    cache = get_cache()
+    if cache is None:
+        access_rules = AccessRules(user)
+        await declare_abilities(user, access_rules)
+        return access_rules
+
+    key = await sync_to_async(get_cache_key)(cache, user)
+    access_rules = await cache.aget(key)
+    if access_rules is not None:
+        access_rules.user = user
+        return access_rules
+
+    access_rules = AccessRules(user)
+    await declare_abilities(user, access_rules)
+    await cache.aset(key, access_rules, timeout=get_timeout())
+    return access_rules
@@ -0,0 +1,153 @@
+"""
+Compiles rules declared for an action and a subject into an immutable bucket,
+with the Q object and flags used by `Ability` computed once.
+"""
+
+from collections import namedtuple
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.constants import LOOKUP_SEP
+
+
+def is_multivalued(model, lookup):
+    """
+    Checks if a lookup spans a many-to-many or a reverse foreign key relation,
+    in which case filtering by it may return duplicated rows.
+    """
+    for part in lookup.split(LOOKUP_SEP):
+        try:
+            field = model._meta.pk if part == "pk" else model._meta.get_field(part)
+        except FieldDoesNotExist:
+            # a lookup or a transform
+            return False
+        if not field.is_relation:
+            return False
+        if field.many_to_many or field.one_to_many:
+            return True
+        model = field.related_model
+    return False
+
+
+class Rule(
+    namedtuple("Rule", ["type", "action", "subject", "conditions", "multivalued"])
+):
+    """
+    Compiled form of a rule declared with `allow` or `deny`. Conditions must not be
+    modified, as compiled rules may be shared between threads.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, rule):
+        conditions = rule.get("conditions", {})
+        # rules bound from a plan are analyzed in advance
+        multivalued = rule.get("multivalued")
+        if multivalued is None:
+            multivalued = any(
+                is_multivalued(rule["subject"], lookup) for lookup in conditions
+            )
+        return cls(
+            rule["type"], rule["action"], rule["subject"], conditions, multivalued
+        )
+
+
+def is_unconditional(rules):
+    return any(len(rule.conditions) == 0 for rule in rules)
+
+
+def rules_to_q(rules):
+    """
+    Combines rule conditions into a single Q object. Returns None when there are no rules,
+    and an empty Q when any rule has no conditions (nothing is filtered out).
+    """
+    if len(rules) == 0:
+        return None
+    if is_unconditional(rules):
+        return Q()
+    q = Q()
+    for rule in rules:
+        q |= Q(**rule.conditions)
+    return q
+
+
+def rules_are_multivalued(rules):
+    return any(rule.multivalued for rule in rules)
+
+
+def rules_to_deny_q(model, rules):
+    """
+    Combines conditions of cannot-type rules into a Q object, which excludes objects
+    matching any of them. Conditions spanning multi-valued relations are compiled into
+    NOT EXISTS subqueries, so that the outer query is not joined with them.
+    """
+    q = Q()
+    for rule in rules:
+        if rule.multivalued:
+            subquery = model._default_manager.filter(
+                pk=OuterRef("pk"), **rule.conditions
+            )
+            q &= Q(~Exists(subquery))
+        else:
+            q &= ~Q(**rule.conditions)
+    return q
+
+
+def bucket_to_q(model, can, cannot):
+    """
+    Combines all rules for an action into a single Q object. Returns None when
+    nothing is allowed, and an empty Q when everything is allowed.
+    """
+    if is_unconditional(cannot):
+        return None
+    q = rules_to_q(can)
+    if q is None:
+        return None
+    return q & rules_to_deny_q(model, cannot)
+
+
+class CompiledBucket(
+    namedtuple(
+        "CompiledBucket", ["model", "can", "cannot", "q", "denies_all", "distinct"]
+    )
+):
+    """
+    Rules for an action and a model:
+    q - None when nothing is allowed, an empty Q when everything is allowed
+    denies_all - an unconditional cannot-type rule is declared
+    distinct - allowed rows must be made distinct, as conditions join multi-valued relations
+    """
+
+    __slots__ = ()
+
+    def __reduce__(self):
+        # Q objects may hold subqueries, which can not be pickled without
+        # being evaluated, so the bucket is compiled again when unpickled
+        return compile_rules, (self.model, self.can, self.cannot)
+
+
+EMPTY_COMPILED_BUCKET = CompiledBucket(None, (), (), None, False, False)
+
+
+def compile_rules(model, can, cannot):
+    can = tuple(can)
+    cannot = tuple(cannot)
+    return CompiledBucket(
+        model=model,
+        can=can,
+        cannot=cannot,
+        q=bucket_to_q(model, can, cannot),
+        denies_all=is_unconditional(cannot),
+        distinct=not is_unconditional(can) and rules_are_multivalued(can),
+    )
+
+
+def compile_bucket(model, bucket):
+    """
+    Compiles a bucket of rules returned by `AccessRules.lookup`
+    """
+    return compile_rules(
+        model,
+        [Rule.from_dict(rule) for rule in bucket["can"]],
+        [Rule.from_dict(rule) for rule in bucket["cannot"]],
+    )
@@ -0,0 +1,47 @@
+from functools import lru_cache
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from .access_rules import clear_subject_cache
+
+
+@lru_cache(maxsize=None)
+def get_declare_abilities():
+    """
+    Returns the function declaring abilities, as configured by CANCAN["ABILITIES"].
+    The function is resolved once and re-resolved when CANCAN setting changes.
+    """
+    if not hasattr(settings, "CANCAN"):
+        raise ImproperlyConfigured("CANCAN section not found in settings")
+    if "ABILITIES" not in settings.CANCAN:
+        raise ImproperlyConfigured(
+            "CANCAN['ABILITIES'] is missing. It must point to a function"
+        )
+
+    fn_name = settings.CANCAN["ABILITIES"]
+    try:
+        declare_abilities = import_string(fn_name)
+    except ImportError as e:
+        raise ImproperlyConfigured(
+            f"CANCAN['ABILITIES'] {fn_name} could not be imported: {e}"
+        ) from e
+
+    if not callable(declare_abilities):
+        raise ImproperlyConfigured(
+            f"{fn_name} must be callable function fn(user: User, rules: AccessRules)"
+        )
+    return declare_abilities
+
+
+@receiver(setting_changed)
+def reset_settings(setting, **kwargs):
+    if setting == "CANCAN":
+        get_declare_abilities.cache_clear()
+    if setting == "INSTALLED_APPS":
+        # app registry is reloaded, models resolved from labels are stale
+        from .backends import parse_perm
+
+        clear_subject_cache()
+        parse_perm.cache_clear()
@@ -0,0 +1,70 @@
+"""
+Django Rest Framework integration. Requires djangorestframework to be installed.
+
+    class ArticleViewSet(ModelViewSet):
+        queryset = Article.objects.all()
+        permission_classes = [CanCanPermission]
+        filter_backends = [CanCanFilterBackend]
+"""
+
+from django.db.models import CharField, Value
+from rest_framework import filters, permissions
+
+# annotated by CanCanFilterBackend on objects of the filtered queryset
+FILTERED_ACTION = "_cancan_action"
+
+# viewset actions -> abilities, can be extended with `ability_actions` view attribute
+VIEWSET_ACTIONS = {
+    "list": "view",
+    "retrieve": "view",
+    "create": "add",
+    "update": "change",
+    "partial_update": "change",
+    "destroy": "delete",
+}
+
+# used by views which are not viewsets
+METHOD_ACTIONS = {
+    "GET": "view",
+    "HEAD": "view",
+    "OPTIONS": "view",
+    "POST": "add",
+    "PUT": "change",
+    "PATCH": "change",
+    "DELETE": "delete",
+}
+
+
+def get_ability_action(request, view):
+    action = getattr(view, "action", None)
+    if action is None:
+        return METHOD_ACTIONS.get(request.method)
+    actions = {**VIEWSET_ACTIONS, **getattr(view, "ability_actions", {})}
+    return actions.get(action, action)
+
+
+class CanCanPermission(permissions.BasePermission):
+    def has_permission(self, request, view):
+        action = get_ability_action(request, view)
+        return request.ability.can(action, view.get_queryset().model)
+
+    def has_object_permission(self, request, view, obj):
+        action = get_ability_action(request, view)
+        if getattr(obj, FILTERED_ACTION, None) == action:
+            # obj was fetched from a queryset filtered by CanCanFilterBackend
+            return True
+        return request.ability.can(action, obj)
+
+
+class CanCanFilterBackend(filters.BaseFilterBackend):
+    """
+    Limits querysets to the objects for which the action is allowed. Objects of the
+    filtered queryset are marked with the action, so CanCanPermission does not need
+    to check them again, while other objects are still checked.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        action = get_ability_action(request, view)
+        return request.ability.filter(action, queryset).annotate(
+            **{FILTERED_ACTION: Value(action, output_field=CharField())}
+        )
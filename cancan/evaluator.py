@@ -0,0 +1,150 @@
+"""
+Evaluates rule conditions against an already loaded model instance, so that
+simple object checks do not need a database round trip.
+
+Each function returns True or False when the answer can be decided in Python,
+or None when it can not (unsupported lookup, expression values, relations that
+are not loaded yet, deferred fields, ...). In the latter case the caller is
+expected to fall back to SQL.
+"""
+
+import datetime
+import operator
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Model
+from django.db.models.constants import LOOKUP_SEP
+
+COMPARISONS = {
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+}
+
+LOOKUPS = {"exact", "iexact", "in", "isnull", *COMPARISONS}
+
+
+def evaluate(instance, conditions):
+    result = True
+    for lookup, value in conditions.items():
+        matched = evaluate_lookup(instance, lookup, value)
+        if matched is False:
+            return False
+        if matched is None:
+            result = None
+    return result
+
+
+def evaluate_lookup(instance, lookup, value):
+    parts = lookup.split(LOOKUP_SEP)
+    lookup_type = "exact"
+    if len(parts) > 1 and parts[-1] in LOOKUPS:
+        lookup_type = parts.pop()
+
+    obj = instance
+    for i, part in enumerate(parts):
+        is_last = i == len(parts) - 1
+        try:
+            field = obj._meta.pk if part == "pk" else obj._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+
+        if not field.concrete:
+            # reverse relations would need a query
+            return None
+
+        if field.is_relation:
+            if field.many_to_many:
+                return None
+            target = field.target_field
+            if is_last:
+                # compare on the foreign key column, related object is not needed
+                return compare(
+                    target, obj, field.attname, lookup_type, to_target(value, target)
+                )
+            if i + 1 == len(parts) - 1 and (
+                parts[i + 1] == target.name
+                or (parts[i + 1] == "pk" and target.primary_key)
+            ):
+                return compare(
+                    target, obj, field.attname, lookup_type, to_target(value, target)
+                )
+            if not field.is_cached(obj):
+                return None
+            obj = field.get_cached_value(obj)
+            if obj is None:
+                return None
+            continue
+
+        if not is_last:
+            # transforms, i.e. date__year
+            return None
+        return compare(field, obj, field.attname, lookup_type, value)
+
+
+def compare(field, obj, attname, lookup_type, value):
+    if attname in obj.get_deferred_fields():
+        return None
+    if hasattr(value, "resolve_expression"):
+        # F(), Subquery(), QuerySet, ...
+        return None
+
+    current = getattr(obj, attname)
+
+    if lookup_type == "isnull":
+        return (current is None) == bool(value)
+
+    if lookup_type == "exact" and value is None:
+        return current is None
+
+    try:
+        current = field.to_python(current)
+        if lookup_type == "in":
+            values = [field.to_python(v) for v in value]
+        else:
+            value = field.to_python(value)
+    except (ValidationError, TypeError, ValueError):
+        return None
+
+    if current is None:
+        # NULL never matches a comparison in SQL
+        return False
+
+    if lookup_type == "in":
+        if any(not comparable(current, v) for v in values):
+            return None
+        return current in values
+
+    if not comparable(current, value):
+        return None
+
+    if lookup_type == "exact":
+        return current == value
+    if lookup_type == "iexact":
+        if isinstance(current, str) and isinstance(value, str):
+            return current.lower() == value.lower()
+        return None
+    try:
+        return COMPARISONS[lookup_type](current, value)
+    except TypeError:
+        return None
+
+
+def to_target(value, target):
+    """
+    Returns the value of a foreign key column, which is not the pk with `to_field`
+    """
+    if isinstance(value, Model):
+        return getattr(value, target.attname)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [to_target(v, target) for v in value]
+    return value
+
+
+def comparable(a, b):
+    """
+    Naive and aware datetimes compare differently in Python and in the database
+    """
+    if isinstance(a, datetime.datetime) and isinstance(b, datetime.datetime):
+        return (a.tzinfo is None) == (b.tzinfo is None)
+    return True
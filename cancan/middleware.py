@@ -1,39 +1,146 @@
+import asyncio
+from functools import partial
+from asgiref.sync import async_to_sync, sync_to_async
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.deprecation import MiddlewareMixin
 from django.utils.functional import SimpleLazyObject
-from django.utils.module_loading import import_string
-from .access_rules import AccessRules
 from .ability import Ability
+from .cache import aget_access_rules, get_access_rules
+from .conf import get_declare_abilities
+from .stats import InstrumentedAbility, ability_stats, measure_build, stats_enabled
+
+
+def create_ability(access_rules, build=None):
+    options = {
+        "in_memory": settings.CANCAN.get("IN_MEMORY_CHECKS", False),
+        "warn_repeated": settings.CANCAN.get("WARN_REPEATED_CHECKS"),
+    }
+    if not stats_enabled():
+        return Ability(access_rules, **options)
+    ability = InstrumentedAbility(access_rules, **options)
+    if build is not None:
+        ability.stats.build_queries = build.queries
+        ability.stats.build_time = build.time
+    return ability
+
+
+def is_event_loop_running():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def build_ability(user, declare_abilities):
+    if asyncio.iscoroutinefunction(declare_abilities):
+        if is_event_loop_running():
+            # async_to_sync can not be used in the thread of the event loop
+            raise RuntimeError(
+                "CANCAN['ABILITIES'] is a coroutine function, which can not be run "
+                "by request.ability in async code. Use await request.aability() instead."
+            )
+        declare_abilities = async_to_sync(declare_abilities)
+    with measure_build() as build:
+        access_rules = get_access_rules(user, declare_abilities)
+    ability = create_ability(access_rules, build)
+    # shared with CanCanBackend, so that user.has_perm uses the same ability
+    user._cancan_ability = ability
+    return ability
+
+
+async def abuild_ability(user, declare_abilities):
+    async with measure_build() as build:
+        if asyncio.iscoroutinefunction(declare_abilities):
+            access_rules = await aget_access_rules(user, declare_abilities)
+        else:
+            access_rules = await sync_to_async(get_access_rules)(
+                user, declare_abilities
+            )
+    ability = create_ability(access_rules, build)
+    user._cancan_ability = ability
+    return ability
 
 
 def get_validator(request, declare_abilities):
-    access_rules = AccessRules(request.user)
-    declare_abilities(request.user, access_rules)
-    return Ability(access_rules)
+    # CanCanBackend may have built the ability already, i.e. in user.has_perm
+    ability = getattr(request.user, "_cancan_ability", None)
+    if ability is not None:
+        return ability
+    return build_ability(request.user, declare_abilities)
 
 
-class CanCanMiddleware(MiddlewareMixin):
-    def process_request(self, request):
-        assert hasattr(request, "user"), (
-            "Cancan authentication middleware requires authenticationMiddleware middleware "
-            "to be installed. Edit your MIDDLEWARE setting to insert "
-            "'django.contrib.auth.middleware.AuthenticationMiddleware' before."
-            "'cancan.middleware.CanCanMiddleware'"
-        )
+async def aget_validator(request, declare_abilities):
+    user = await aget_user(request)
+    ability = getattr(user, "_cancan_ability", None)
+    if ability is not None:
+        return ability
+    return await abuild_ability(user, declare_abilities)
+
 
-        assert hasattr(settings, "CANCAN"), "CANCAN section not found in settings"
-        assert (
-            "ABILITIES" in settings.CANCAN
-        ), "CANCAN['ABILITIES'] is missing. It must point to a function"
-        fn_name = settings.CANCAN["ABILITIES"]
+async def aget_user(request):
+    if hasattr(request, "auser"):
+        return await request.auser()
 
-        declare_abilities = import_string(settings.CANCAN["ABILITIES"])
+    def get_user():
+        # evaluate the lazy user outside of the event loop
+        request.user.is_authenticated
+        return request.user
 
-        assert callable(
-            declare_abilities
-        ), f"{fn_name}  must be callabe function fn(user: User, ability: Ability)"
+    return await sync_to_async(get_user)()
 
+
+def get_ability(request, declare_abilities):
+    if not hasattr(request, "_cached_ability"):
+        request._cached_ability = get_validator(request, declare_abilities)
+    return request._cached_ability
+
+
+async def aget_ability(request, declare_abilities):
+    if not hasattr(request, "_cached_ability"):
+        request._cached_ability = await aget_validator(request, declare_abilities)
+    return request._cached_ability
+
+
+class CanCanMiddleware(MiddlewareMixin):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        # fail at startup if CANCAN setting is invalid
+        get_declare_abilities()
+
+    def process_request(self, request):
+        if not hasattr(request, "user"):
+            raise ImproperlyConfigured(
+                "Cancan authentication middleware requires authenticationMiddleware middleware "
+                "to be installed. Edit your MIDDLEWARE setting to insert "
+                "'django.contrib.auth.middleware.AuthenticationMiddleware' before "
+                "'cancan.middleware.CanCanMiddleware'"
+            )
+
+        declare_abilities = get_declare_abilities()
+        # request.ability is used in sync code, await request.aability() in async code
         request.ability = SimpleLazyObject(
-            lambda: get_validator(request, declare_abilities)
+            lambda: get_ability(request, declare_abilities)
         )
+        request.aability = partial(aget_ability, request, declare_abilities)
+
+    def process_response(self, request, response):
+        ability = getattr(request, "_cached_ability", None)
+        if ability is None or ability.stats is None:
+            return response
+        ability_stats.send(sender=self.__class__, request=request, stats=ability.stats)
+        header = settings.CANCAN.get("STATS_HEADER")
+        if header:
+            response[header] = str(ability.stats)
+        return response
+
+    async def __acall__(self, request):
+        # neither process_request nor process_response block,
+        # so there is no need to run them in a thread
+        self.process_request(request)
+        response = await self.get_response(request)
+        return self.process_response(request, response)
@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+
+
+class AbilityListMixin:
+    """
+    Limits a list view to objects for which `ability_action` is allowed
+    """
+
+    ability_action = "view"
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.ability.can(self.ability_action, self.get_ability_model()):
+            raise PermissionDenied
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_ability_model(self):
+        return self.model or self.queryset.model
+
+    def get_queryset(self):
+        return self.request.ability.filter(self.ability_action, super().get_queryset())
+
+
+class AbilityObjectMixin:
+    """
+    Fetches the object of a detail, update or delete view from a queryset limited
+    to objects for which `ability_action` is allowed, so the permission check and
+    the fetch are a single query. An object that is not allowed results in 404,
+    or in 403 when CANCAN["MISSING_OBJECT"] is "403".
+    """
+
+    ability_action = "view"
+
+    def get_queryset(self):
+        return self.request.ability.filter(self.ability_action, super().get_queryset())
+
+    def get_object(self, queryset=None):
+        if queryset is None and hasattr(self, "_ability_object"):
+            return self._ability_object
+        try:
+            obj = super().get_object(queryset)
+        except Http404:
+            if getattr(settings, "CANCAN", {}).get("MISSING_OBJECT") == "403":
+                self.raise_if_exists()
+            raise
+        if queryset is None:
+            self._ability_object = obj
+        return obj
+
+    def raise_if_exists(self):
+        """
+        Raises PermissionDenied if the object exists, but the action is not allowed
+        """
+        queryset = super().get_queryset()
+        try:
+            super().get_object(queryset)
+        except Http404:
+            return
+        raise PermissionDenied
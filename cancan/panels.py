@@ -0,0 +1,33 @@
+"""
+Panel for django-debug-toolbar, showing statistics of ability checks. Requires
+CANCAN["STATS"] = True, add "cancan.panels.CanCanPanel" to DEBUG_TOOLBAR_PANELS.
+"""
+
+from debug_toolbar.panels import Panel
+from django.utils.html import format_html, format_html_join
+
+
+class CanCanPanel(Panel):
+    title = "CanCan"
+
+    @property
+    def nav_subtitle(self):
+        stats = self.get_stats()
+        if not stats:
+            return "Stats disabled"
+        return f"{stats['checks']} checks in {stats['time'] * 1000:.2f}ms"
+
+    def generate_stats(self, request, response):
+        ability = getattr(request, "_cached_ability", None)
+        if ability is not None and ability.stats is not None:
+            self.record_stats(ability.stats.as_dict())
+
+    @property
+    def content(self):
+        stats = self.get_stats()
+        if not stats:
+            return "Set CANCAN['STATS'] = True to collect statistics."
+        rows = format_html_join(
+            "", "<tr><th>{}</th><td>{}</td></tr>", sorted(stats.items())
+        )
+        return format_html("<table>{}</table>", rows)
@@ -0,0 +1,139 @@
+"""
+Ability plans are rule templates declared once, i.e. at import time, and bound
+to a user on each request. Binding only substitutes user-specific values, as
+subjects are resolved and rules are analyzed when the plan is declared.
+
+    MEMBER = AbilityPlan()
+    MEMBER.allow("view", "core.Project", created_by=Param("user"))
+    MEMBER.allow("view", "core.Project", organization=Param("user.profile.organization_id"))
+    MEMBER.deny("view", "core.Project", archived=True)
+
+    def declare_abilities(user, rules):
+        MEMBER(user, rules)
+"""
+
+from .compiler import compile_bucket, is_multivalued
+from .access_rules import normalize_subject
+
+
+class Param:
+    """
+    Placeholder for a value that is known when a plan is bound, i.e. Param("user")
+    or Param("user.profile.organization_id") for an attribute of a bound value.
+    """
+
+    def __init__(self, path):
+        self.name, *self.attrs = path.split(".")
+
+    def __repr__(self):
+        return f"Param({'.'.join([self.name, *self.attrs])!r})"
+
+    def resolve(self, values):
+        value = values[self.name]
+        for attr in self.attrs:
+            value = getattr(value, attr)
+        return value
+
+
+class AbilityPlan:
+    def __init__(self, get_params=None):
+        # function returning values of params for a user, by default {"user": user}
+        self.get_params = get_params or (lambda user: {"user": user})
+        self.templates = []
+        # (subject, action) -> {"can": [...], "cannot": [...]} of templates
+        self.buckets = {}
+        # (subject, action) -> CompiledBucket, or None for buckets with params
+        self.compiled = {}
+
+    def _add_template(self, rule_type, action, subject, conditions):
+        subject = normalize_subject(subject)
+        static = {}
+        params = []
+        for lookup, value in conditions.items():
+            if isinstance(value, Param):
+                params.append((lookup, value))
+            else:
+                static[lookup] = value
+        multivalued = any(is_multivalued(subject, lookup) for lookup in conditions)
+        template = {
+            "type": rule_type,
+            "action": action,
+            "subject": subject,
+            "static": static,
+            "params": params,
+            "multivalued": multivalued,
+            # rules without params are the same for every user, and are shared
+            "rule": (
+                None
+                if params
+                else {
+                    "type": rule_type,
+                    "action": action,
+                    "subject": subject,
+                    "conditions": static,
+                    "multivalued": multivalued,
+                }
+            ),
+        }
+        self.templates.append(template)
+        key = (subject, action)
+        bucket = self.buckets.setdefault(key, {"can": [], "cannot": []})
+        bucket[rule_type].append(template)
+        self.compiled.pop(key, None)
+        return template
+
+    def allow(self, action, subject, **kwargs):
+        return self._add_template("can", action, subject, kwargs)
+
+    def deny(self, action, subject, **kwargs):
+        return self._add_template("cannot", action, subject, kwargs)
+
+    def _bind_template(self, template, values):
+        if template["rule"] is not None:
+            return template["rule"]
+        conditions = dict(template["static"])
+        for lookup, param in template["params"]:
+            conditions[lookup] = param.resolve(values)
+        return {
+            "type": template["type"],
+            "action": template["action"],
+            "subject": template["subject"],
+            "conditions": conditions,
+            "multivalued": template["multivalued"],
+        }
+
+    def _compile(self, key, bucket):
+        # buckets without params are compiled once, when the plan is first bound
+        try:
+            return self.compiled[key]
+        except KeyError:
+            pass
+        compiled = None
+        if all(template["rule"] for template in bucket["can"] + bucket["cannot"]):
+            compiled = compile_bucket(key[0], self._bind_bucket(bucket, {}))
+        self.compiled[key] = compiled
+        return compiled
+
+    def _bind_bucket(self, bucket, values):
+        return {
+            rule_type: [self._bind_template(template, values) for template in templates]
+            for rule_type, templates in bucket.items()
+        }
+
+    def bind(self, access_rules, **values):
+        """
+        Adds rules to access_rules, with params replaced by the given values
+        """
+        buckets = {}
+        compiled = {}
+        for key, bucket in self.buckets.items():
+            buckets[key] = self._bind_bucket(bucket, values)
+            compiled_bucket = self._compile(key, bucket)
+            if compiled_bucket is not None:
+                compiled[key] = compiled_bucket
+        access_rules._add_buckets(buckets, compiled)
+        return access_rules
+
+    def __call__(self, user, access_rules):
+        # plans can be used directly as CANCAN["ABILITIES"]
+        return self.bind(access_rules, **self.get_params(user))
@@ -0,0 +1,38 @@
+from .access_rules import lazy_declarations, normalize_subject
+
+
+def rules_for(*subjects):
+    """
+    Registers a function declaring rules for the given models or apps. The function
+    is called with (user, rules) only when abilities for one of them are checked:
+
+    @rules_for(Project, "core.Issue")
+    def project_rules(user, rules):
+        rules.allow("view", Project, created_by=user)
+
+    @rules_for("billing")
+    def billing_rules(user, rules):
+        ...
+    """
+
+    def decorator(fn):
+        for subject in subjects:
+            if isinstance(subject, str) and "." not in subject:
+                # app label
+                key = subject
+            else:
+                key = normalize_subject(subject)
+            declarations = lazy_declarations.setdefault(key, [])
+            if fn not in declarations:
+                declarations.append(fn)
+        return fn
+
+    return decorator
+
+
+def unregister(fn):
+    for key, declarations in list(lazy_declarations.items()):
+        if fn in declarations:
+            declarations.remove(fn)
+        if not declarations:
+            del lazy_declarations[key]
@@ -0,0 +1,192 @@
+"""
+Per-request statistics of ability checks, enabled with CANCAN["STATS"] = True.
+
+When enabled, `request.ability` is an `InstrumentedAbility` and `request.ability.stats`
+counts checks, cache hits, queries and time spent. When disabled, plain `Ability` is
+used, so there is no overhead at all.
+"""
+
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+from .ability import Ability
+
+# sent by CanCanMiddleware for each response, with `request` and `stats` arguments
+ability_stats = Signal()
+
+
+def stats_enabled():
+    return bool(getattr(settings, "CANCAN", {}).get("STATS"))
+
+
+def measure_build():
+    """
+    Returns a context manager measuring the declaration of rules, which yields
+    BuildStats, or None when statistics are disabled
+    """
+    if not stats_enabled():
+        return NoMeasure()
+    return Measure(BuildStats())
+
+
+class AbilityStats:
+    def __init__(self, ability):
+        self.ability = ability
+        # number of checked objects or models, and of filtered querysets
+        self.checks = 0
+        self.querysets = 0
+        # SQL statements executed, and seconds spent, in checks
+        self.queries = 0
+        self.time = 0.0
+        # same for declaring rules, see BuildStats
+        self.build_queries = 0
+        self.build_time = 0.0
+
+    @property
+    def cache_hits(self):
+        return self.ability.cache_info().hits
+
+    def as_dict(self):
+        return {
+            "checks": self.checks,
+            "querysets": self.querysets,
+            "cache_hits": self.cache_hits,
+            "queries": self.queries,
+            "time": self.time,
+            "build_queries": self.build_queries,
+            "build_time": self.build_time,
+        }
+
+    def __str__(self):
+        return (
+            f"checks={self.checks}, querysets={self.querysets}, "
+            f"cache_hits={self.cache_hits}, queries={self.queries}, "
+            f"time={self.time * 1000:.2f}ms, build_queries={self.build_queries}, "
+            f"build_time={self.build_time * 1000:.2f}ms"
+        )
+
+
+class BuildStats:
+    """
+    Queries and time spent in declaring rules, which are measured before the ability
+    exists and are copied to its stats
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.time = 0.0
+
+
+class Measure:
+    """
+    Measures time of calls and counts SQL statements executed by them, in the same
+    way as `cancan.testing.assert_ability_queries`
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.depth = 0
+
+    def count_query(self, execute, sql, params, many, context):
+        self.stats.queries += 1
+        return execute(sql, params, many, context)
+
+    def _start(self):
+        self.wrapper = connection.execute_wrapper(self.count_query)
+        self.wrapper.__enter__()
+        self.start = time.perf_counter()
+
+    def _stop(self, *exc_info):
+        self.stats.time += time.perf_counter() - self.start
+        self.wrapper.__exit__(*exc_info)
+
+    def __enter__(self):
+        self.depth += 1
+        if self.depth == 1:
+            self._start()
+        return self.stats
+
+    def __exit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0:
+            self._stop(*exc_info)
+
+    async def __aenter__(self):
+        # queries of async calls are executed by the thread running sync code,
+        # which has its own connection
+        self.depth += 1
+        if self.depth == 1:
+            await sync_to_async(self._start)()
+        return self.stats
+
+    async def __aexit__(self, *exc_info):
+        self.depth -= 1
+        if self.depth == 0:
+            await sync_to_async(self._stop)(*exc_info)
+
+
+class NoMeasure:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        pass
+
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class InstrumentedAbility(Ability):
+    """
+    Ability collecting statistics in `stats`. Nested calls, i.e. `can` calling
+    `validate_instance`, are measured once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = AbilityStats(self)
+        self._measure = Measure(self.stats)
+
+    def can(self, action, subject):
+        with self._measure:
+            self.stats.checks += 1
+            return super().can(action, subject)
+
+    async def acan(self, action, subject):
+        async with self._measure:
+            self.stats.checks += 1
+            return await super().acan(action, subject)
+
+    def validate_instance(self, action, instance):
+        with self._measure:
+            return super().validate_instance(action, instance)
+
+    def can_many(self, action, objects):
+        objects = list(objects)
+        with self._measure:
+            self.stats.checks += len(objects)
+            return super().can_many(action, objects)
+
+    async def acan_many(self, action, objects):
+        objects = list(objects)
+        async with self._measure:
+            self.stats.checks += len(objects)
+            return await super().acan_many(action, objects)
+
+    def filter(self, action, queryset, distinct=None):
+        # can_many filters a queryset internally, which is not counted
+        if self._measure.depth == 0:
+            self.stats.querysets += 1
+        with self._measure:
+            return super().filter(action, queryset, distinct)
+
+    def annotate(self, queryset, **actions):
+        if self._measure.depth == 0:
+            self.stats.querysets += 1
+        with self._measure:
+            return super().annotate(queryset, **actions)
@@ -12,42 +12,88 @@ class AbilityCheck:
     {% if ability|can:"view"|subject:project %}
         <a href="#" class="card-footer-item">View</a>
     {% endif %}
+    Each filter returns a new check, and the result is computed only once.
     """
 
-    def __init__(self, ability):
+    def __init__(self, ability, action=None, subject=None):
         self.ability = ability
-        self.action = None
-        self.subject = None
+        self.action = action
+        self.subject = subject
+        self._result = None
 
     def __repr__(self):
         return f"{self.ability}(action={self.action},subject={self.subject})"
 
     def __bool__(self):
-        return self.ability.can(self.action, self.subject)
+        if self._result is None:
+            self._result = self.ability.can(self.action, self.subject)
+        return self._result
 
 
-@register.filter
-def can(ability, action):
-    if not isinstance(ability, AbilityCheck):
-        assert isinstance(
-            ability, Ability
-        ), f"can filter must be applied to Ability instance (you provided {type(ability)})"
-        ability = AbilityCheck(ability)
-    ability.action = action
-    return ability
+def to_ability_check(ability, filter_name):
+    if isinstance(ability, AbilityCheck):
+        return ability
+    assert isinstance(
+        ability, Ability
+    ), f"{filter_name} filter must be applied to Ability instance (you provided {type(ability)})"
+    return AbilityCheck(ability)
+
+
+@register.filter(name="can")
+def can_filter(ability, action):
+    check = to_ability_check(ability, "can")
+    return AbilityCheck(check.ability, action, check.subject)
 
 
 @register.filter
 def subject(ability, subject):
-    if not isinstance(ability, AbilityCheck):
-        assert isinstance(
-            ability, Ability
-        ), f"subject filter must be applied to Ability instance (you provided {type(ability)})"
-        ability = AbilityCheck(ability)
-    ability.subject = subject
-    return ability
+    check = to_ability_check(ability, "subject")
+    return AbilityCheck(check.ability, check.action, subject)
 
 
-@register.simple_tag(takes_context=True)
-def can(context, action, subject):
+@register.simple_tag(name="can", takes_context=True)
+def can_tag(context, action, subject):
     return context["request"].ability.can(action, subject)
+
+
+def get_context_ability(context):
+    return context.get("ability") or context["request"].ability
+
+
+@register.simple_tag(takes_context=True)
+def prefetch_abilities(context, objects, *actions):
+    """
+    Checks abilities for all objects at once, i. e.
+    {% prefetch_abilities object_list "view" "change" %}
+    so that checks inside a loop over object_list do not hit the database.
+    """
+    ability = get_context_ability(context)
+    objects = list(objects)
+    for action in actions:
+        ability.can_many(action, objects)
+    return ""
+
+
+@register.simple_tag(takes_context=True)
+def load_abilities(context, objects, *actions):
+    """
+    Checks abilities for all objects at once and returns them by object pk, i. e.
+    {% load_abilities object_list "view" "change" as perms %}
+    {% for project in object_list %}
+        {% if perms|get:project.pk|get:"change" %}...{% endif %}
+    {% endfor %}
+    """
+    ability = get_context_ability(context)
+    objects = list(objects)
+    perms = {obj.pk: {action: False for action in actions} for obj in objects}
+    for action in actions:
+        for pk, allowed in ability.can_many(action, objects).items():
+            perms[pk][action] = allowed
+    return perms
+
+
+@register.filter
+def get(mapping, key):
+    if not mapping:
+        return None
+    return mapping.get(key)
@@ -0,0 +1,69 @@
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from cancan.testapp.models import Article, User
+from cancan.backends import parse_perm
+from cancan.middleware import CanCanMiddleware
+
+declarations = []
+
+
+def get_abilities(user, rules):
+    declarations.append(user)
+    rules.allow("view", Article, is_published=True)
+    if user.is_authenticated:
+        rules.allow("change", Article, created_by=user)
+
+
+@override_settings(
+    AUTHENTICATION_BACKENDS=["cancan.backends.CanCanBackend"],
+    CANCAN={"ABILITIES": "cancan.testapp.tests.test_backends.get_abilities"},
+)
+class CanCanBackendTestCase(TestCase):
+    def setUp(self):
+        declarations.clear()
+        self.user = User.objects.create(username="user1")
+
+    def test_parse_perm(self):
+        self.assertEqual(parse_perm("testapp.view_article"), ("view", Article))
+        self.assertEqual(parse_perm("auth.change_user"), ("change", User))
+        self.assertIsNone(parse_perm("testapp.article"))
+        self.assertIsNone(parse_perm("testapp.view_unknown"))
+        self.assertIsNone(parse_perm("unknown.view_article"))
+
+    def test_has_perm(self):
+        article1 = Article.objects.create(created_by=self.user)
+        article2 = Article.objects.create()
+        self.assertTrue(self.user.has_perm("testapp.view_article"))
+        self.assertTrue(self.user.has_perm("testapp.change_article"))
+        self.assertFalse(self.user.has_perm("testapp.delete_article"))
+        self.assertTrue(self.user.has_perm("testapp.change_article", article1))
+        self.assertFalse(self.user.has_perm("testapp.change_article", article2))
+        # objects of another model do not grant its permissions
+        self.assertFalse(self.user.has_perm("auth.change_user", article1))
+        self.assertTrue(self.user.has_module_perms("testapp"))
+        self.assertFalse(self.user.has_module_perms("auth"))
+        self.assertEqual(len(declarations), 1)
+
+    def test_anonymous_and_inactive_users(self):
+        self.assertTrue(AnonymousUser().has_perm("testapp.view_article"))
+        self.assertFalse(AnonymousUser().has_perm("testapp.change_article"))
+        self.user.is_active = False
+        self.assertFalse(self.user.has_perm("testapp.view_article"))
+
+    def test_ability_is_shared_with_request(self):
+        request = RequestFactory().get("/")
+        request.user = self.user
+        CanCanMiddleware(lambda request: HttpResponse())(request)
+        self.assertTrue(request.ability.can("view", Article))
+        self.assertTrue(request.user.has_perm("testapp.view_article"))
+        self.assertEqual(len(declarations), 1)
+
+    def test_ability_is_shared_with_request_when_backend_is_first(self):
+        request = RequestFactory().get("/")
+        request.user = self.user
+        CanCanMiddleware(lambda request: HttpResponse())(request)
+        self.assertTrue(request.user.has_perm("testapp.view_article"))
+        self.assertTrue(request.ability.can("view", Article))
+        self.assertIs(request.ability._wrapped, self.user._cancan_ability)
+        self.assertEqual(len(declarations), 1)
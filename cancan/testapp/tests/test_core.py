@@ -1,7 +1,12 @@
+import pickle
+from unittest import mock, skipUnless
+import django
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from cancan.testapp.models import Article, User
 from cancan.ability import Ability
-from cancan.access_rules import AccessRules
+from cancan.access_rules import AccessRules, normalize_subject, subject_cache
 
 
 class NoAbilitiesTestCase(TestCase):
@@ -110,6 +115,61 @@ class AliasesTestCase(TestCase):
         self.assertEqual(self.ability.queryset_for("list", Article).count(), 1)
 
 
+class AliasGraphTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.article = Article.objects.create(name="test")
+        self.access_rules = AccessRules(user=self.user)
+        self.access_rules.alias_action("manage", "crud")
+        self.access_rules.alias_action("crud", "view", "change", "delete")
+        self.access_rules.alias_action("view", "list")
+        self.ability = Ability(self.access_rules)
+
+    def test_alias_to_action_is_deprecated(self):
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual(self.access_rules.alias_to_action("list"), "view")
+        with self.assertWarns(DeprecationWarning):
+            self.assertEqual(self.access_rules.alias_to_action("manage"), "manage")
+
+    def test_nested_aliases(self):
+        self.access_rules.allow("manage", Article)
+        self.assertEqual(
+            self.access_rules.get_implied_actions("list"),
+            ("list", "view", "crud", "manage"),
+        )
+        self.assertTrue(self.ability.can("list", Article))
+        self.assertTrue(self.ability.can("change", self.article))
+        self.assertFalse(self.ability.can("publish", self.article))
+        self.assertEqual(self.ability.queryset_for("list", Article).count(), 1)
+
+    def test_rules_of_alias_and_action_are_merged(self):
+        other = Article.objects.create(name="other", is_published=True)
+        self.access_rules.allow("list", Article, name="test")
+        self.access_rules.allow("view", Article, is_published=True)
+        self.assertEqual(
+            set(self.ability.queryset_for("list", Article)), {self.article, other}
+        )
+        self.assertEqual(list(self.ability.queryset_for("view", Article)), [other])
+
+    def test_deny_applies_to_aliases(self):
+        self.access_rules.allow("manage", Article)
+        self.access_rules.deny("crud", Article, name="test")
+        self.assertFalse(self.ability.can("delete", self.article))
+        self.assertFalse(self.ability.can("list", self.article))
+
+    def test_merged_buckets_follow_changes(self):
+        self.assertFalse(self.ability.can("view", Article))
+        self.access_rules.allow("crud", Article)
+        self.assertTrue(self.ability.can("view", Article))
+        self.access_rules.alias_action("view", "read")
+        self.assertTrue(self.ability.can("read", Article))
+
+    def test_cycles(self):
+        self.access_rules.alias_action("list", "manage")
+        self.access_rules.allow("list", Article)
+        self.assertTrue(self.ability.can("delete", Article))
+
+
 class MiscTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create(username="user1")
@@ -121,3 +181,479 @@ class MiscTestCase(TestCase):
 
     def test_in_operator(self):
         self.assertTrue(("view", Article) in self.ability)
+
+
+class AccessRulesIndexTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+
+    def test_rules_are_indexed_by_subject_and_action(self):
+        access_rules = AccessRules(user=self.user)
+        rule1 = access_rules.allow("view", Article, is_published=True)
+        rule2 = access_rules.allow("view", "testapp.Article", created_by=self.user)
+        rule3 = access_rules.allow("change", Article, created_by=self.user)
+        self.assertEqual(access_rules.lookup("view", Article)["can"], [rule1, rule2])
+        self.assertEqual(access_rules.lookup("change", Article)["can"], [rule3])
+        self.assertEqual(len(access_rules.lookup("delete", Article)["can"]), 0)
+        self.assertEqual(len(access_rules.rules), 3)
+
+    def test_many_rules(self):
+        access_rules = AccessRules(user=self.user)
+        for i in range(500):
+            access_rules.allow(f"action{i}", User)
+        access_rules.allow("view", Article, is_published=True)
+        ability = Ability(access_rules)
+        article = Article.objects.create(name="test", is_published=True)
+        self.assertTrue(ability.can("view", Article))
+        self.assertTrue(ability.can("view", article))
+        self.assertFalse(ability.can("action1", Article))
+
+
+class ResultCacheTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        access_rules = AccessRules(user=self.user)
+        access_rules.allow("view", Article, name__contains="public")
+        self.ability = Ability(access_rules, cache_size=2)
+
+    def test_repeated_checks_are_cached(self):
+        article = Article.objects.create(name="public article")
+        with self.assertNumQueries(1):
+            self.assertTrue(self.ability.can("view", article))
+            self.assertTrue(self.ability.can("view", article))
+            self.assertTrue(("view", article) in self.ability)
+        info = self.ability.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (2, 1, 1))
+
+    def test_invalidate_object(self):
+        article = Article.objects.create(name="public article")
+        self.assertTrue(self.ability.can("view", article))
+        Article.objects.filter(pk=article.pk).update(name="private article")
+        self.assertTrue(self.ability.can("view", article))
+        self.ability.invalidate(article)
+        self.assertFalse(self.ability.can("view", article))
+
+    def test_invalidate_all(self):
+        article = Article.objects.create(name="public article")
+        self.assertTrue(self.ability.can("view", article))
+        self.ability.invalidate()
+        self.assertEqual(self.ability.cache_info().currsize, 0)
+
+    def test_cache_is_bounded(self):
+        articles = [Article.objects.create(name="public") for i in range(3)]
+        for article in articles:
+            self.ability.can("view", article)
+        self.assertEqual(self.ability.cache_info().currsize, 2)
+
+    def test_new_rules_discard_cached_results(self):
+        article = Article.objects.create(name="test")
+        self.assertFalse(self.ability.can("view", article))
+        self.ability.access_rules.allow("view", Article)
+        self.assertTrue(self.ability.can("view", article))
+
+
+class CanManyTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        access_rules = AccessRules(user=self.user)
+        access_rules.allow("view", Article, is_published=True)
+        access_rules.allow("change", Article, name__contains="draft")
+        self.ability = Ability(access_rules)
+
+    def test_one_query_for_many_objects(self):
+        articles = [Article.objects.create(name=f"draft {i}") for i in range(5)]
+        articles += [Article.objects.create(name=f"final {i}") for i in range(5)]
+        with self.assertNumQueries(1):
+            results = self.ability.can_many("change", articles)
+        self.assertEqual(
+            results, {article.pk: "draft" in article.name for article in articles}
+        )
+        with self.assertNumQueries(0):
+            for article in articles:
+                self.assertEqual(
+                    self.ability.can("change", article), "draft" in article.name
+                )
+
+    def test_queryset_decided_in_memory(self):
+        Article.objects.create(name="a", is_published=True)
+        Article.objects.create(name="b", is_published=False)
+        articles = Article.objects.all()
+        ability = Ability(self.ability.access_rules, in_memory=True)
+        with self.assertNumQueries(1):
+            results = ability.can_many("view", articles)
+        self.assertEqual(sorted(results.values()), [False, True])
+
+    def test_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.ability.can_many("view", []), {})
+
+
+class AnnotateTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        access_rules = AccessRules(user=self.user)
+        access_rules.allow("view", Article)
+        access_rules.allow("change", Article, created_by__username="user1")
+        access_rules.allow("change", Article, name="b")
+        access_rules.allow("view", User, articles__name="a")
+        self.ability = Ability(access_rules)
+
+    def test_flags_are_computed_in_one_query(self):
+        Article.objects.create(name="a", created_by=self.user)
+        Article.objects.create(name="b")
+        Article.objects.create(name="c")
+        qs = self.ability.annotate(
+            Article.objects.order_by("name"),
+            view="can_view",
+            change="can_change",
+            delete="can_delete",
+        )
+        with self.assertNumQueries(1):
+            rows = list(qs.values_list("name", "can_view", "can_change", "can_delete"))
+        self.assertEqual(
+            rows,
+            [
+                ("a", True, True, False),
+                ("b", True, True, False),
+                ("c", True, False, False),
+            ],
+        )
+
+    def test_multivalued_relation_does_not_duplicate_rows(self):
+        other_user = User.objects.create(username="user2")
+        Article.objects.create(name="a", created_by=self.user)
+        Article.objects.create(name="a", created_by=self.user)
+        qs = self.ability.annotate(User.objects.order_by("username"), view="can_view")
+        self.assertEqual(
+            list(qs.values_list("username", "can_view")),
+            [("user1", True), ("user2", False)],
+        )
+
+
+@skipUnless(django.VERSION >= (4, 1), "async ORM requires Django 4.1")
+class AsyncAbilityTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        access_rules = AccessRules(user=self.user)
+        access_rules.allow("view", Article, is_published=True)
+        access_rules.allow("change", Article, name__contains="draft")
+        self.ability = Ability(access_rules)
+
+    async def test_acan(self):
+        article1 = await Article.objects.acreate(name="draft")
+        article2 = await Article.objects.acreate(name="final", is_published=True)
+        self.assertTrue(await self.ability.acan("view", Article))
+        self.assertTrue(await self.ability.acan("change", article1))
+        self.assertFalse(await self.ability.acan("change", article2))
+        self.assertTrue(await self.ability.acan("view", article2))
+        self.assertFalse(await self.ability.acan("delete", article2))
+
+    async def test_acan_many(self):
+        article1 = await Article.objects.acreate(name="draft")
+        article2 = await Article.objects.acreate(name="final")
+        results = await self.ability.acan_many("change", [article1, article2])
+        self.assertEqual(results, {article1.pk: True, article2.pk: False})
+
+    async def test_aqueryset_for(self):
+        await Article.objects.acreate(name="final", is_published=True)
+        qs = await self.ability.aqueryset_for("view", Article)
+        self.assertEqual(await qs.acount(), 1)
+
+
+class InstanceQueryTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        access_rules = AccessRules(user=self.user)
+        access_rules.allow("view", Article, name__contains="public")
+        access_rules.allow("view", Article, created_by__username="user1")
+        access_rules.allow("change", Article, name__contains="draft")
+        access_rules.allow("change", Article)
+        self.ability = Ability(access_rules, in_memory=False, cache_size=0)
+
+    def test_single_exists_query(self):
+        article = Article.objects.create(name="private")
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertFalse(self.ability.can("view", article))
+        self.assertEqual(len(ctx.captured_queries), 1)
+        sql = ctx.captured_queries[0]["sql"]
+        self.assertNotIn("COUNT", sql)
+        self.assertIn("LIMIT 1", sql)
+        self.assertEqual(sql.count('"testapp_article"."id" ='), 1)
+        self.assertIn(" OR ", sql)
+
+    def test_unconditional_rule_short_circuits(self):
+        article = Article.objects.create(name="private")
+        with self.assertNumQueries(0):
+            self.assertTrue(self.ability.can("change", article))
+
+
+class QuerysetForTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        access_rules = AccessRules(user=self.user)
+        access_rules.allow("view", Article, is_published=True)
+        access_rules.allow("view", Article, created_by__username="user1")
+        access_rules.allow("view", User, articles__name__contains="a")
+        self.ability = Ability(access_rules)
+
+    def test_single_filter_without_distinct(self):
+        Article.objects.create(name="a", created_by=self.user)
+        Article.objects.create(name="b", is_published=True)
+        Article.objects.create(name="c")
+        qs = self.ability.queryset_for("view", Article)
+        sql = str(qs.query)
+        self.assertNotIn("DISTINCT", sql)
+        self.assertEqual(sql.count("WHERE"), 1)
+        self.assertIn(" OR ", sql)
+        self.assertEqual(sorted(qs.values_list("name", flat=True)), ["a", "b"])
+
+    def test_distinct_for_multivalued_relations(self):
+        Article.objects.create(name="a1", created_by=self.user)
+        Article.objects.create(name="a2", created_by=self.user)
+        qs = self.ability.queryset_for("view", User)
+        self.assertIn("DISTINCT", str(qs.query))
+        self.assertEqual(list(qs), [self.user])
+
+    def test_force_distinct(self):
+        self.assertIn(
+            "DISTINCT", str(self.ability.queryset_for("view", Article, True).query)
+        )
+        self.assertNotIn(
+            "DISTINCT", str(self.ability.queryset_for("view", User, False).query)
+        )
+
+
+class UnconditionalRuleTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        access_rules = AccessRules(user=self.user)
+        access_rules.allow("view", User, articles__name__contains="a")
+        access_rules.allow("view", User, username="user1")
+        access_rules.allow("view", User)
+        self.ability = Ability(access_rules)
+
+    def test_plain_queryset(self):
+        User.objects.create(username="user2")
+        qs = self.ability.queryset_for("view", User)
+        sql = str(qs.query)
+        self.assertNotIn("WHERE", sql)
+        self.assertNotIn("DISTINCT", sql)
+        self.assertNotIn("JOIN", sql)
+        self.assertEqual(qs.count(), 2)
+
+    def test_annotate(self):
+        qs = self.ability.annotate(User.objects.all(), view="can_view")
+        self.assertNotIn("EXISTS", str(qs.query))
+        self.assertTrue(qs.get().can_view)
+
+
+class DenyTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.other_user = User.objects.create(username="user2")
+        access_rules = AccessRules(user=self.user)
+        access_rules.allow("view", Article)
+        access_rules.deny("view", Article, is_published=False)
+        access_rules.allow("change", Article, created_by=self.user)
+        access_rules.deny("change", Article, name__contains="locked")
+        access_rules.allow("view", User)
+        access_rules.deny("view", User, articles__name__contains="secret")
+        access_rules.allow("delete", Article)
+        access_rules.deny("delete", Article)
+        # object checks are decided in memory where possible
+        self.ability = Ability(access_rules, in_memory=True)
+
+    def test_model_checks(self):
+        with self.assertNumQueries(0):
+            self.assertTrue(self.ability.can("view", Article))
+            self.assertTrue(self.ability.can("change", Article))
+            self.assertFalse(self.ability.can("delete", Article))
+
+    def test_instance_checks_in_memory(self):
+        article1 = Article.objects.create(name="a", is_published=True)
+        article2 = Article.objects.create(name="b", is_published=False)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.ability.can("view", article1))
+            self.assertFalse(self.ability.can("view", article2))
+            self.assertFalse(self.ability.can("delete", article1))
+
+    def test_instance_checks_in_sql(self):
+        article1 = Article.objects.create(name="a", created_by=self.user)
+        article2 = Article.objects.create(name="locked", created_by=self.user)
+        article3 = Article.objects.create(name="c", created_by=self.other_user)
+        with self.assertNumQueries(2):
+            self.assertTrue(self.ability.can("change", article1))
+            self.assertFalse(self.ability.can("change", article2))
+            self.assertFalse(self.ability.can("change", article3))
+
+    def test_queryset_for(self):
+        Article.objects.create(name="a", is_published=True)
+        Article.objects.create(name="b", is_published=False)
+        Article.objects.create(name="locked", created_by=self.user)
+        Article.objects.create(name="d", created_by=self.user)
+        self.assertEqual(
+            list(
+                self.ability.queryset_for("view", Article).values_list(
+                    "name", flat=True
+                )
+            ),
+            ["a"],
+        )
+        self.assertEqual(
+            list(
+                self.ability.queryset_for("change", Article).values_list(
+                    "name", flat=True
+                )
+            ),
+            ["d"],
+        )
+        self.assertEqual(self.ability.queryset_for("delete", Article).count(), 0)
+
+    def test_relational_deny_is_not_exists(self):
+        Article.objects.create(name="secret 1", created_by=self.other_user)
+        Article.objects.create(name="secret 2", created_by=self.other_user)
+        Article.objects.create(name="public", created_by=self.user)
+        qs = self.ability.queryset_for("view", User)
+        sql = str(qs.query)
+        self.assertIn("NOT EXISTS", sql)
+        self.assertNotIn("DISTINCT", sql)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(qs), [self.user])
+        with self.assertNumQueries(2):
+            self.assertTrue(self.ability.can("view", self.user))
+            self.assertFalse(self.ability.can("view", self.other_user))
+
+    def test_annotate_and_can_many(self):
+        article1 = Article.objects.create(name="a", created_by=self.user)
+        article2 = Article.objects.create(name="locked", created_by=self.user)
+        qs = self.ability.annotate(
+            Article.objects.order_by("name"), change="can_change"
+        )
+        self.assertEqual(
+            list(qs.values_list("name", "can_change")), [("a", True), ("locked", False)]
+        )
+        with self.assertNumQueries(1):
+            results = self.ability.can_many("change", [article1, article2])
+        self.assertEqual(results, {article1.pk: True, article2.pk: False})
+
+
+class NormalizeSubjectTestCase(TestCase):
+    def test_labels_are_resolved(self):
+        self.assertIs(normalize_subject("testapp.Article"), Article)
+        self.assertIs(normalize_subject("testapp.article"), Article)
+        self.assertIs(normalize_subject("auth.User"), User)
+        self.assertIs(normalize_subject(Article), Article)
+
+    def test_labels_are_cached(self):
+        normalize_subject("testapp.Article")
+        with mock.patch("cancan.access_rules.apps.get_model") as get_model:
+            self.assertIs(normalize_subject("testapp.Article"), Article)
+        get_model.assert_not_called()
+
+    def test_unknown_labels_fail(self):
+        with self.assertRaises(LookupError):
+            normalize_subject("testapp.Unknown")
+        with self.assertRaises(LookupError):
+            normalize_subject("unknown.Article")
+        with self.assertRaises(LookupError):
+            normalize_subject("Article")
+        access_rules = AccessRules(user=None)
+        with self.assertRaises(LookupError):
+            access_rules.allow("view", "testapp.Unknown")
+
+    def test_cache_is_cleared_when_apps_change(self):
+        normalize_subject("testapp.Article")
+        with self.settings(
+            INSTALLED_APPS=["django.contrib.auth", "django.contrib.contenttypes"]
+        ):
+            self.assertNotIn("testapp.Article", subject_cache)
+            with self.assertRaises(LookupError):
+                normalize_subject("testapp.Article")
+        self.assertIs(normalize_subject("testapp.Article"), Article)
+
+
+class PrefetchTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1")
+        self.user2 = User.objects.create(username="user2")
+        access_rules = AccessRules(user=self.user1)
+        access_rules.allow("view", Article, is_published=True)
+        access_rules.allow("view", Article, created_by=self.user1)
+        self.ability = Ability(access_rules)
+
+    def test_related_objects_are_filtered(self):
+        Article.objects.create(name="a", created_by=self.user1)
+        Article.objects.create(name="b", created_by=self.user2)
+        Article.objects.create(name="c", created_by=self.user2, is_published=True)
+        users = self.ability.prefetch(User.objects.order_by("username"), "articles")
+        with self.assertNumQueries(2):
+            names = [[a.name for a in user.articles.all()] for user in users]
+        self.assertEqual(names, [["a"], ["c"]])
+
+    def test_to_attr(self):
+        Article.objects.create(name="b", created_by=self.user2)
+        users = User.objects.prefetch_related(
+            self.ability.get_prefetch(User, "articles", to_attr="visible_articles")
+        )
+        self.assertEqual([user.visible_articles for user in users], [[], []])
+
+    def test_unknown_relation(self):
+        with self.assertRaises(ValueError):
+            self.ability.prefetch(User.objects.all(), "unknown")
+
+    def test_nested_lookup_limits_each_level(self):
+        self.ability.access_rules.allow("view", User, pk=self.user1.pk)
+        Article.objects.create(name="a", created_by=self.user1)
+        Article.objects.create(name="b", created_by=self.user1, is_published=True)
+        Article.objects.create(name="c", created_by=self.user2, is_published=True)
+        articles = self.ability.prefetch(
+            Article.objects.filter(is_published=True).order_by("name"),
+            "created_by__articles",
+        )
+        with self.assertNumQueries(3):
+            authors = [article.created_by for article in articles]
+            self.assertIsNone(authors[1])
+            self.assertEqual(
+                sorted(a.name for a in authors[0].articles.all()), ["a", "b"]
+            )
+        with self.assertRaises(ValueError):
+            self.ability.get_prefetch(Article, "created_by__articles")
+
+
+class FreezeTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.other_user = User.objects.create(username="user2")
+        self.article = Article.objects.create(name="secret", created_by=self.other_user)
+        access_rules = AccessRules(user=self.user)
+        access_rules.alias_action("view", "list")
+        access_rules.allow("view", Article, is_published=True)
+        access_rules.allow("view", Article, created_by=self.user)
+        access_rules.allow("view", User)
+        access_rules.deny("view", User, articles__name="secret")
+        self.frozen = access_rules.freeze()
+
+    def test_frozen_rules_are_compiled(self):
+        bucket = self.frozen.lookup("list", Article)
+        self.assertIsInstance(bucket.can, tuple)
+        self.assertEqual(bucket.can[0].conditions, {"is_published": True})
+        self.assertFalse(bucket.distinct)
+        self.assertIsNone(self.frozen.lookup("delete", Article).q)
+        with self.assertRaises(AttributeError):
+            self.frozen.allow("delete", Article)
+
+    def test_ability_with_frozen_rules(self):
+        ability = Ability(self.frozen)
+        self.assertTrue(ability.can("list", Article))
+        self.assertFalse(ability.can("view", self.article))
+        self.assertTrue(ability.can("view", self.user))
+        self.assertFalse(ability.can("view", self.other_user))
+        self.assertEqual(list(ability.queryset_for("view", User)), [self.user])
+
+    def test_pickle(self):
+        frozen = pickle.loads(pickle.dumps(self.frozen))
+        self.assertIsNone(frozen.user)
+        ability = Ability(frozen)
+        self.assertEqual(list(ability.queryset_for("view", User)), [self.user])
+        Article.objects.filter(pk=self.article.pk).update(is_published=True)
+        self.assertTrue(ability.can("list", self.article))
@@ -0,0 +1,90 @@
+from unittest import skipUnless
+from django.test import TestCase
+from cancan.testapp.models import Article, User
+from cancan.ability import Ability
+from cancan.access_rules import AccessRules
+
+try:
+    import rest_framework
+except ImportError:
+    rest_framework = None
+
+if rest_framework:
+    from rest_framework import serializers, viewsets
+    from rest_framework.test import APIRequestFactory
+    from cancan.drf import CanCanFilterBackend, CanCanPermission
+
+    class ArticleSerializer(serializers.ModelSerializer):
+        class Meta:
+            model = Article
+            fields = ["id", "name"]
+
+    class ArticleViewSet(viewsets.ModelViewSet):
+        queryset = Article.objects.all()
+        serializer_class = ArticleSerializer
+        permission_classes = [CanCanPermission]
+        filter_backends = [CanCanFilterBackend]
+        authentication_classes = []
+
+    class OtherArticleViewSet(ArticleViewSet):
+        def retrieve(self, request, *args, **kwargs):
+            # an object fetched without the filter backend is checked separately
+            self.get_object()
+            self.check_object_permissions(request, Article.objects.get(name="c"))
+            return super().retrieve(request, *args, **kwargs)
+
+
+@skipUnless(rest_framework, "djangorestframework is not installed")
+class DRFTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        access_rules = AccessRules(self.user)
+        access_rules.allow("view", Article, is_published=True)
+        access_rules.allow("view", Article, created_by=self.user)
+        access_rules.allow("change", Article, created_by=self.user)
+        self.ability = Ability(access_rules)
+        self.article1 = Article.objects.create(name="a", is_published=True)
+        self.article2 = Article.objects.create(name="b", created_by=self.user)
+        self.article3 = Article.objects.create(name="c")
+
+    def request(self, method, action, viewset=None, **kwargs):
+        factory = APIRequestFactory()
+        data = kwargs.pop("data", None)
+        request = getattr(factory, method)("/", data, format="json")
+        request.ability = self.ability
+        view = (viewset or ArticleViewSet).as_view({method: action})
+        return view(request, **kwargs)
+
+    def test_list(self):
+        response = self.request("get", "list")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([a["name"] for a in response.data], ["a", "b"])
+
+    def test_retrieve_with_single_query(self):
+        with self.assertNumQueries(1):
+            response = self.request("get", "retrieve", pk=self.article1.pk)
+        self.assertEqual(response.status_code, 200)
+        # object was not checked again by the permission class
+        self.assertEqual(sum(self.ability.check_paths.values()), 0)
+        response = self.request("get", "retrieve", pk=self.article3.pk)
+        self.assertEqual(response.status_code, 404)
+
+    def test_update(self):
+        response = self.request(
+            "patch", "partial_update", pk=self.article2.pk, data={"name": "x"}
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.request(
+            "patch", "partial_update", pk=self.article1.pk, data={"name": "x"}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_no_model_ability(self):
+        response = self.request("delete", "destroy", pk=self.article2.pk)
+        self.assertEqual(response.status_code, 403)
+
+    def test_objects_not_fetched_through_filter_are_checked(self):
+        response = self.request(
+            "get", "retrieve", viewset=OtherArticleViewSet, pk=self.article1.pk
+        )
+        self.assertEqual(response.status_code, 403)
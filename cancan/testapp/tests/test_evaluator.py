@@ -0,0 +1,144 @@
+from django.db.models import F
+from django.test import TestCase
+from cancan.testapp.models import Article, Note, User
+from cancan.ability import Ability
+from cancan.access_rules import AccessRules
+from cancan.evaluator import evaluate
+
+
+class EvaluatorTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.other_user = User.objects.create(username="user2")
+        self.article = Article.objects.create(
+            name="test", is_published=True, created_by=self.user
+        )
+
+    def test_exact(self):
+        self.assertTrue(evaluate(self.article, {"is_published": True}))
+        self.assertTrue(evaluate(self.article, {"name__exact": "test"}))
+        self.assertFalse(evaluate(self.article, {"name": "other"}))
+        self.assertTrue(evaluate(self.article, {"name__iexact": "TEST"}))
+
+    def test_all_conditions_must_match(self):
+        self.assertTrue(evaluate(self.article, {"name": "test", "is_published": True}))
+        self.assertFalse(
+            evaluate(self.article, {"name": "test", "is_published": False})
+        )
+
+    def test_in_and_comparisons(self):
+        self.assertTrue(evaluate(self.article, {"name__in": ["a", "test"]}))
+        self.assertFalse(evaluate(self.article, {"name__in": ["a", "b"]}))
+        self.assertTrue(evaluate(self.article, {"pk__gte": self.article.pk}))
+        self.assertFalse(evaluate(self.article, {"pk__gt": self.article.pk}))
+        self.assertTrue(evaluate(self.article, {"id__lt": self.article.pk + 1}))
+
+    def test_isnull(self):
+        self.assertFalse(evaluate(self.article, {"created_by__isnull": True}))
+        self.assertTrue(evaluate(self.article, {"created_by": self.user}))
+        self.assertFalse(evaluate(self.article, {"created_by": None}))
+
+    def test_foreign_keys_do_not_need_related_object(self):
+        article = Article.objects.get(pk=self.article.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(evaluate(article, {"created_by": self.user}))
+            self.assertTrue(evaluate(article, {"created_by_id": self.user.pk}))
+            self.assertTrue(evaluate(article, {"created_by__pk": self.user.pk}))
+            self.assertFalse(evaluate(article, {"created_by__id": self.other_user.pk}))
+            self.assertTrue(
+                evaluate(article, {"created_by__in": [self.user, self.other_user]})
+            )
+
+    def test_traversal_over_loaded_relations(self):
+        article = Article.objects.select_related("created_by").get(pk=self.article.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(evaluate(article, {"created_by__username": "user1"}))
+            self.assertFalse(evaluate(article, {"created_by__username": "user2"}))
+
+    def test_undecided(self):
+        article = Article.objects.get(pk=self.article.pk)
+        with self.assertNumQueries(0):
+            # relation is not loaded
+            self.assertIsNone(evaluate(article, {"created_by__username": "user1"}))
+            # reverse relation
+            self.assertIsNone(evaluate(self.user, {"articles__name": "test"}))
+            # expressions
+            self.assertIsNone(evaluate(article, {"name": F("name")}))
+            # unsupported lookup
+            self.assertIsNone(evaluate(article, {"name__contains": "es"}))
+        # a definite mismatch wins over an undecided condition
+        self.assertFalse(evaluate(article, {"name": "other", "name__contains": "es"}))
+
+
+class InMemoryAbilityTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        access_rules = AccessRules(user=self.user)
+        access_rules.allow("view", Article, is_published=True)
+        access_rules.allow("view", Article, created_by=self.user)
+        access_rules.allow("change", Article, name__contains="draft")
+        self.ability = Ability(access_rules, in_memory=True)
+
+    def test_checks_without_queries(self):
+        article1 = Article.objects.create(name="test", is_published=True)
+        article2 = Article.objects.create(name="test", created_by=self.user)
+        article3 = Article.objects.create(name="test")
+        with self.assertNumQueries(0):
+            self.assertTrue(self.ability.can("view", article1))
+            self.assertTrue(self.ability.can("view", article2))
+            self.assertFalse(self.ability.can("view", article3))
+        self.assertEqual(self.ability.check_paths["python"], 3)
+        self.assertEqual(self.ability.check_paths["sql"], 0)
+
+    def test_sql_fallback(self):
+        article1 = Article.objects.create(name="a draft")
+        article2 = Article.objects.create(name="test")
+        with self.assertNumQueries(2):
+            self.assertTrue(self.ability.can("change", article1))
+            self.assertFalse(self.ability.can("change", article2))
+        self.assertEqual(self.ability.check_paths["sql"], 2)
+
+    def test_unsaved_changes_are_not_trusted_by_default(self):
+        article = Article.objects.create(name="test")
+        article.created_by = self.user
+        ability = Ability(self.ability.access_rules)
+        self.assertFalse(ability.can("view", article))
+        self.assertEqual(ability.check_paths["python"], 0)
+
+    def test_in_memory_disabled(self):
+        ability = Ability(self.ability.access_rules, in_memory=False)
+        article = Article.objects.create(name="test", is_published=True)
+        with self.assertNumQueries(1):
+            self.assertTrue(ability.can("view", article))
+        self.assertEqual(ability.check_paths["sql"], 1)
+
+
+class ToFieldTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        self.other_user = User.objects.create(username="user2")
+        self.note = Note.objects.get(
+            pk=Note.objects.create(text="test", owner=self.user).pk
+        )
+
+    def test_foreign_key_to_field(self):
+        with self.assertNumQueries(0):
+            self.assertTrue(evaluate(self.note, {"owner": self.user}))
+            self.assertFalse(evaluate(self.note, {"owner": self.other_user}))
+            self.assertTrue(evaluate(self.note, {"owner__username": "user1"}))
+            self.assertTrue(evaluate(self.note, {"owner__in": [self.user]}))
+            # pk is not stored in the foreign key column
+            self.assertIsNone(evaluate(self.note, {"owner__pk": self.user.pk}))
+
+    def test_allow_and_deny_rules(self):
+        access_rules = AccessRules(user=self.user)
+        access_rules.allow("view", Note, owner=self.user)
+        access_rules.allow("change", Note)
+        access_rules.deny("change", Note, owner__pk=self.user.pk)
+        ability = Ability(access_rules, in_memory=True)
+        self.assertTrue(ability.can("view", self.note))
+        self.assertFalse(ability.can("change", self.note))
+        self.assertEqual(
+            ability.can("view", self.note),
+            ability.queryset_for("view", Note).filter(pk=self.note.pk).exists(),
+        )
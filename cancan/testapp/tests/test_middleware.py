@@ -1,6 +1,15 @@
-from django.test import TestCase, Client, override_settings
+from unittest import mock, skipUnless
+import django
+from django.contrib.auth.models import AnonymousUser, Group
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.http import HttpResponse
+from django.test import TestCase, Client, RequestFactory, override_settings
 from cancan.testapp.models import Article, User
 from cancan.ability import Ability, AccessRules
+from cancan.cache import bump_rules_version, connect_rules_invalidation
+from cancan.middleware import CanCanMiddleware
+from cancan.stats import InstrumentedAbility, ability_stats
 
 
 def get_abilities(user, rules):
@@ -22,3 +31,258 @@ class MiddlewareTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(str(self.article1.id), ids)
         self.assertNotIn(str(self.article2.id), ids)
+
+
+declarations = []
+
+
+def get_counted_abilities(user, rules):
+    declarations.append(user)
+    rules.allow("view", Article, is_published=True)
+    if user.is_authenticated:
+        rules.allow("view", Article, created_by=user)
+
+
+@override_settings(
+    CANCAN={
+        "ABILITIES": "cancan.testapp.tests.test_middleware.get_counted_abilities",
+        "CACHE": "default",
+    },
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class RulesCacheTestCase(TestCase):
+    def setUp(self):
+        declarations.clear()
+        bump_rules_version()
+        self.article1 = Article.objects.create(is_published=True)
+        self.article2 = Article.objects.create(is_published=False)
+
+    def test_rules_are_declared_once(self):
+        c = Client()
+        for i in range(3):
+            response = c.get("/articles/")
+            ids = response.content.decode().split(" ")
+            self.assertIn(str(self.article1.id), ids)
+            self.assertNotIn(str(self.article2.id), ids)
+        self.assertEqual(len(declarations), 1)
+
+    def test_bump_rules_version(self):
+        c = Client()
+        c.get("/articles/")
+        bump_rules_version()
+        c.get("/articles/")
+        self.assertEqual(len(declarations), 2)
+
+    def test_rules_are_cached_per_user(self):
+        user = User.objects.create(username="user1")
+        c = Client()
+        article3 = Article.objects.create(created_by=user)
+        c.get("/articles/")
+        c.force_login(user)
+        c.get("/articles/")
+        response = c.get("/articles/")
+        self.assertIn(str(article3.id), response.content.decode().split(" "))
+        self.assertEqual(len(declarations), 2)
+
+    def test_many_to_many_changes_invalidate_rules(self):
+        user = User.objects.create(username="user1")
+        group = Group.objects.create(name="group")
+        connect_rules_invalidation("auth.User")
+        uid = "cancan_bump_rules_version_auth.User"
+        self.addCleanup(post_save.disconnect, sender=User, dispatch_uid=uid)
+        self.addCleanup(post_delete.disconnect, sender=User, dispatch_uid=uid)
+        for through in (User, User.groups.through, User.user_permissions.through):
+            self.addCleanup(
+                m2m_changed.disconnect,
+                sender=through,
+                dispatch_uid=f"{uid}_{through._meta.label}",
+            )
+        Client().get("/articles/")
+        user.groups.add(group)
+        Client().get("/articles/")
+        self.assertEqual(len(declarations), 2)
+
+
+class MiddlewareConfigurationTestCase(TestCase):
+    def get_response(self, request):
+        return HttpResponse()
+
+    @override_settings(
+        CANCAN={"ABILITIES": "cancan.testapp.tests.test_middleware.get_abilities"}
+    )
+    def test_abilities_are_resolved_once(self):
+        middleware = CanCanMiddleware(self.get_response)
+        with mock.patch("cancan.conf.import_string") as import_string:
+            for i in range(3):
+                request = RequestFactory().get("/")
+                request.user = AnonymousUser()
+                middleware(request)
+                self.assertTrue(request.ability.can("view", Article))
+        import_string.assert_not_called()
+
+    def test_abilities_are_resolved_again_when_settings_change(self):
+        middleware = CanCanMiddleware(self.get_response)
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        middleware(request)
+        self.assertFalse(request.ability.can("view", Article))
+        with override_settings(
+            CANCAN={"ABILITIES": "cancan.testapp.tests.test_middleware.get_abilities"}
+        ):
+            request = RequestFactory().get("/")
+            request.user = AnonymousUser()
+            middleware(request)
+            self.assertTrue(request.ability.can("view", Article))
+
+    def test_invalid_settings(self):
+        invalid = [
+            {},
+            {"ABILITIES": "cancan.testapp.tests.test_middleware.missing"},
+            {"ABILITIES": "cancan.testapp.tests.test_middleware.declarations"},
+        ]
+        for cancan_settings in invalid:
+            with override_settings(CANCAN=cancan_settings):
+                with self.assertRaises(ImproperlyConfigured):
+                    CanCanMiddleware(self.get_response)
+
+    def test_missing_authentication_middleware(self):
+        middleware = CanCanMiddleware(self.get_response)
+        with self.assertRaises(ImproperlyConfigured):
+            middleware(RequestFactory().get("/"))
+
+
+async def aget_abilities(user, rules):
+    rules.allow("view", Article, is_published=True)
+
+
+@skipUnless(django.VERSION >= (4, 1), "async ORM requires Django 4.1")
+class AsyncMiddlewareTestCase(TestCase):
+    async def get_response(self, request):
+        ability = await request.aability()
+        allowed = await ability.acan("view", self.article)
+        return HttpResponse(str(allowed))
+
+    @override_settings(
+        CANCAN={"ABILITIES": "cancan.testapp.tests.test_middleware.get_abilities"}
+    )
+    async def test_async_middleware(self):
+        self.article = await Article.objects.acreate(is_published=True)
+        middleware = CanCanMiddleware(self.get_response)
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        response = await middleware(request)
+        self.assertEqual(response.content, b"True")
+
+    @override_settings(
+        CANCAN={"ABILITIES": "cancan.testapp.tests.test_middleware.aget_abilities"}
+    )
+    async def test_coroutine_abilities_function(self):
+        self.article = await Article.objects.acreate(is_published=True)
+        middleware = CanCanMiddleware(self.get_response)
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        response = await middleware(request)
+        self.assertEqual(response.content, b"True")
+
+    @override_settings(
+        CANCAN={"ABILITIES": "cancan.testapp.tests.test_middleware.aget_abilities"}
+    )
+    async def test_coroutine_abilities_function_with_sync_ability(self):
+        middleware = CanCanMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        middleware.process_request(request)
+        with self.assertRaisesMessage(RuntimeError, "await request.aability()"):
+            request.ability.can("view", Article)
+
+    @override_settings(
+        CANCAN={"ABILITIES": "cancan.testapp.tests.test_middleware.aget_abilities"}
+    )
+    def test_coroutine_abilities_function_in_sync_code(self):
+        article = Article.objects.create(is_published=True)
+        middleware = CanCanMiddleware(lambda request: HttpResponse())
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        middleware(request)
+        self.assertTrue(request.ability.can("view", article))
+
+
+def get_queried_abilities(user, rules):
+    if Article.objects.filter(created_by=user).exists():
+        rules.allow("view", Article)
+
+
+@override_settings(
+    CANCAN={
+        "ABILITIES": "cancan.testapp.tests.test_middleware.get_abilities",
+        "STATS": True,
+        "STATS_HEADER": "X-CanCan-Stats",
+    }
+)
+class StatsTestCase(TestCase):
+    def test_stats_header_and_signal(self):
+        received = []
+
+        def receiver(request, stats, **kwargs):
+            received.append(stats.as_dict())
+
+        ability_stats.connect(receiver)
+        self.addCleanup(ability_stats.disconnect, receiver)
+        response = Client().get("/articles/")
+        self.assertIn("querysets=1", response["X-CanCan-Stats"])
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]["querysets"], 1)
+
+    def test_instrumented_ability(self):
+        user = User.objects.create(username="user1")
+        article = Article.objects.create(name="draft")
+        access_rules = AccessRules(user)
+        access_rules.allow("view", Article, name__contains="draft")
+        ability = InstrumentedAbility(access_rules)
+        for i in range(2):
+            self.assertTrue(ability.can("view", article))
+        ability.can_many("view", [Article.objects.create(name="other draft")])
+        stats = ability.stats
+        self.assertEqual((stats.checks, stats.cache_hits, stats.queries), (3, 1, 2))
+        self.assertEqual(stats.querysets, 0)
+        qs = ability.queryset_for("view", Article)
+        self.assertEqual(stats.querysets, 1)
+        self.assertGreater(stats.time, 0)
+        # querysets are evaluated by the caller, not by the ability
+        list(qs)
+        self.assertEqual(stats.queries, 2)
+
+    async def test_queries_of_async_checks(self):
+        article = await Article.objects.acreate(name="draft")
+        access_rules = AccessRules(None)
+        access_rules.allow("view", Article, name__contains="draft")
+        ability = InstrumentedAbility(access_rules)
+        self.assertTrue(await ability.acan("view", article))
+        await ability.acan_many("view", [await Article.objects.acreate(name="b")])
+        self.assertEqual((ability.stats.checks, ability.stats.queries), (2, 2))
+
+    @override_settings(
+        CANCAN={
+            "ABILITIES": "cancan.testapp.tests.test_middleware.get_queried_abilities",
+            "STATS": True,
+        }
+    )
+    def test_queries_of_declaring_rules(self):
+        user = User.objects.create(username="user1")
+        article = Article.objects.create(created_by=user)
+        request = RequestFactory().get("/")
+        request.user = user
+        CanCanMiddleware(lambda request: HttpResponse())(request)
+        self.assertTrue(request.ability.can("view", article))
+        stats = request.ability.stats
+        self.assertEqual((stats.build_queries, stats.queries), (1, 0))
+        self.assertGreater(stats.build_time, 0)
+
+    @override_settings(
+        CANCAN={"ABILITIES": "cancan.testapp.tests.test_middleware.get_abilities"}
+    )
+    def test_disabled(self):
+        response = Client().get("/articles/")
+        self.assertNotIn("X-CanCan-Stats", response)
+        self.assertIsNone(response.wsgi_request.ability.stats)
+        self.assertIs(type(response.wsgi_request.ability._wrapped), Ability)
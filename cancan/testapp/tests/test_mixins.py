@@ -0,0 +1,85 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import PermissionDenied
+from django.http import Http404
+from django.test import RequestFactory, TestCase, override_settings
+from django.views.generic import DetailView, ListView, UpdateView
+from cancan.testapp.models import Article, User
+from cancan.ability import Ability
+from cancan.access_rules import AccessRules
+from cancan.mixins import AbilityListMixin, AbilityObjectMixin
+
+
+class ArticleListView(AbilityListMixin, ListView):
+    model = Article
+
+
+class ArticleDetailView(AbilityObjectMixin, DetailView):
+    model = Article
+    template_name = "testapp/article_list.html"
+
+
+class ArticleUpdateView(AbilityObjectMixin, UpdateView):
+    model = Article
+    fields = ["name"]
+    ability_action = "change"
+    template_name = "testapp/article_list.html"
+    success_url = "/"
+
+
+class AbilityMixinsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        access_rules = AccessRules(self.user)
+        access_rules.allow("view", Article, name__contains="public")
+        access_rules.allow("change", Article, created_by=self.user)
+        self.ability = Ability(access_rules)
+        self.article1 = Article.objects.create(name="public", created_by=self.user)
+        self.article2 = Article.objects.create(name="private")
+
+    def get_request(self, method="get", data=None):
+        request = getattr(RequestFactory(), method)("/", data)
+        request.user = self.user
+        request.ability = self.ability
+        return request
+
+    def test_list_view(self):
+        response = ArticleListView.as_view()(self.get_request())
+        self.assertEqual(list(response.context_data["object_list"]), [self.article1])
+
+    def test_list_view_without_model_ability(self):
+        self.ability = Ability(AccessRules(self.user))
+        with self.assertRaises(PermissionDenied):
+            ArticleListView.as_view()(self.get_request())
+
+    def test_detail_view_fetches_object_once(self):
+        with self.assertNumQueries(1):
+            response = ArticleDetailView.as_view()(
+                self.get_request(), pk=self.article1.pk
+            )
+        self.assertEqual(response.context_data["object"], self.article1)
+
+    def test_update_view(self):
+        response = ArticleUpdateView.as_view()(
+            self.get_request("post", {"name": "changed"}), pk=self.article1.pk
+        )
+        self.assertEqual(response.status_code, 302)
+        with self.assertRaises(Http404):
+            ArticleUpdateView.as_view()(
+                self.get_request("post", {"name": "changed"}), pk=self.article2.pk
+            )
+
+    def test_missing_object(self):
+        with self.assertRaises(Http404):
+            ArticleDetailView.as_view()(self.get_request(), pk=self.article2.pk)
+
+    @override_settings(
+        CANCAN={
+            "ABILITIES": "cancan.testapp.abilities.get_abilities",
+            "MISSING_OBJECT": "403",
+        }
+    )
+    def test_missing_object_as_permission_denied(self):
+        with self.assertRaises(PermissionDenied):
+            ArticleDetailView.as_view()(self.get_request(), pk=self.article2.pk)
+        with self.assertRaises(Http404):
+            ArticleDetailView.as_view()(self.get_request(), pk=0)
@@ -0,0 +1,83 @@
+from django.test import TestCase
+from cancan.testapp.models import Article, User
+from cancan.ability import Ability
+from cancan.access_rules import AccessRules
+from cancan.plans import AbilityPlan, Param
+
+AUTHOR = AbilityPlan()
+AUTHOR.allow("view", "testapp.Article", is_published=True)
+AUTHOR.allow("view", Article, created_by=Param("user"))
+AUTHOR.allow("change", Article, created_by_id=Param("user.pk"))
+AUTHOR.deny("change", Article, name__contains="locked")
+AUTHOR.allow("view", User, articles__is_published=True)
+
+
+class AbilityPlanTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1")
+        self.user2 = User.objects.create(username="user2")
+
+    def get_ability(self, user):
+        access_rules = AccessRules(user)
+        AUTHOR(user, access_rules)
+        return Ability(access_rules)
+
+    def test_plan_is_bound_per_user(self):
+        article1 = Article.objects.create(name="a", created_by=self.user1)
+        article2 = Article.objects.create(name="b", created_by=self.user2)
+        article3 = Article.objects.create(name="locked", created_by=self.user1)
+        ability1 = self.get_ability(self.user1)
+        ability2 = self.get_ability(self.user2)
+        self.assertTrue(ability1.can("view", article1))
+        self.assertFalse(ability1.can("view", article2))
+        self.assertTrue(ability2.can("view", article2))
+        self.assertTrue(ability1.can("change", article1))
+        self.assertFalse(ability1.can("change", article3))
+        self.assertEqual(list(ability2.queryset_for("change", Article)), [article2])
+
+    def test_rules_are_analyzed_once(self):
+        access_rules = AUTHOR.bind(AccessRules(self.user1), user=self.user1)
+        self.assertEqual(
+            [rule["multivalued"] for rule in access_rules.rules],
+            [False, False, False, False, True],
+        )
+        self.assertEqual(access_rules.rules[0]["subject"], Article)
+        self.assertIn(
+            "DISTINCT", str(Ability(access_rules).queryset_for("view", User).query)
+        )
+
+    def test_custom_params(self):
+        plan = AbilityPlan(lambda user: {"name": user.username})
+        plan.allow("view", Article, name=Param("name"))
+        article = Article.objects.create(name="user1")
+        access_rules = AccessRules(self.user1)
+        plan(self.user1, access_rules)
+        self.assertTrue(Ability(access_rules).can("view", article))
+
+    def test_bind_is_a_single_change(self):
+        access_rules = AccessRules(self.user1)
+        AUTHOR.bind(access_rules, user=self.user1)
+        self.assertEqual(access_rules.version, 1)
+        self.assertEqual(len(access_rules.rules), 5)
+
+    def test_buckets_without_params_are_compiled_once(self):
+        access_rules1 = AUTHOR.bind(AccessRules(self.user1), user=self.user1)
+        access_rules2 = AUTHOR.bind(AccessRules(self.user2), user=self.user2)
+        # view of users has no params, it is shared by all bound rules
+        self.assertIs(
+            access_rules1.compile("view", User), access_rules2.compile("view", User)
+        )
+        self.assertIsNot(
+            access_rules1.compile("view", Article),
+            access_rules2.compile("view", Article),
+        )
+
+    def test_compiled_buckets_are_merged_with_other_rules(self):
+        access_rules = AccessRules(self.user1)
+        access_rules.allow("view", User, username="user2")
+        AUTHOR.bind(access_rules, user=self.user1)
+        access_rules.alias_action("view", "list")
+        ability = Ability(access_rules)
+        self.assertTrue(ability.can("view", self.user2))
+        self.assertTrue(ability.can("list", self.user2))
+        self.assertFalse(ability.can("view", self.user1))
@@ -0,0 +1,95 @@
+from django.test import TestCase
+from cancan import rules_for
+from cancan.testapp.models import Article, User
+from cancan.ability import Ability
+from cancan.access_rules import AccessRules
+from cancan.registry import unregister
+
+calls = []
+
+
+def article_rules(user, rules):
+    calls.append("article")
+    rules.allow("view", Article, created_by=user)
+
+
+def auth_rules(user, rules):
+    calls.append("auth")
+    rules.allow("view", User, pk=user.pk)
+
+
+class RulesForTestCase(TestCase):
+    def setUp(self):
+        calls.clear()
+        rules_for("testapp.Article")(article_rules)
+        rules_for("auth")(auth_rules)
+        self.user = User.objects.create(username="user1")
+
+    def tearDown(self):
+        unregister(article_rules)
+        unregister(auth_rules)
+
+    def test_rules_are_declared_on_demand(self):
+        ability = Ability(AccessRules(self.user))
+        article = Article.objects.create(name="a", created_by=self.user)
+        self.assertTrue(ability.can("view", article))
+        self.assertTrue(ability.can("view", Article))
+        self.assertEqual(calls, ["article"])
+        self.assertEqual(ability.queryset_for("view", User).get(), self.user)
+        self.assertEqual(calls, ["article", "auth"])
+
+    def test_app_rules_are_declared_once(self):
+        ability = Ability(AccessRules(self.user))
+        ability.can("view", User)
+        ability.can("view", "auth.Group")
+        self.assertEqual(calls, ["auth"])
+
+    def test_unregister(self):
+        unregister(article_rules)
+        ability = Ability(AccessRules(self.user))
+        self.assertFalse(ability.can("view", Article))
+        self.assertEqual(calls, [])
+
+    def test_lazy_load_keeps_cached_results(self):
+        ability = Ability(AccessRules(self.user))
+        article = Article.objects.create(name="a", created_by=self.user)
+        self.assertTrue(ability.can("view", article))
+        self.assertFalse(ability.can("change", User))
+        self.assertTrue(ability.can("view", article))
+        self.assertEqual(ability.cache_info().hits, 1)
+
+    def test_lazy_rules_for_checked_subject_invalidate_results(self):
+        def more_user_rules(user, rules):
+            rules.allow("change", User, pk=user.pk)
+
+        rules_for(Article)(more_user_rules)
+        self.addCleanup(unregister, more_user_rules)
+        ability = Ability(AccessRules(self.user))
+        self.assertFalse(ability.can("change", self.user))
+        ability.can("view", Article)
+        self.assertTrue(ability.can("change", self.user))
+
+    def test_freeze_declares_all_rules(self):
+        frozen = AccessRules(self.user).freeze()
+        self.assertEqual(sorted(calls), ["article", "auth"])
+        self.assertTrue(Ability(frozen).can("view", User))
+
+    async def test_rules_are_declared_outside_of_event_loop(self):
+        def queried_rules(user, rules):
+            # raises SynchronousOnlyOperation when run in the event loop
+            if User.objects.filter(pk=user.pk).exists():
+                rules.allow("change", Article)
+
+        rules_for(Article)(queried_rules)
+        self.addCleanup(unregister, queried_rules)
+        article = await Article.objects.acreate(name="a")
+        for subject in (Article, article):
+            ability = Ability(AccessRules(self.user))
+            self.assertTrue(await ability.acan("change", subject))
+        ability = Ability(AccessRules(self.user))
+        self.assertEqual(
+            await ability.acan_many("change", [article]), {article.pk: True}
+        )
+        ability = Ability(AccessRules(self.user))
+        qs = await ability.aqueryset_for("change", Article)
+        self.assertEqual(await qs.acount(), 1)
@@ -0,0 +1,84 @@
+from django.template import Context, Template
+from django.test import TestCase
+from cancan.testapp.models import Article, User
+from cancan.ability import Ability
+from cancan.access_rules import AccessRules
+
+
+class PrefetchAbilitiesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        access_rules = AccessRules(user=self.user)
+        access_rules.allow("change", Article, name__contains="draft")
+        self.ability = Ability(access_rules)
+
+    def test_checks_in_loop_use_prefetched_results(self):
+        Article.objects.create(name="draft")
+        Article.objects.create(name="final")
+        template = Template(
+            "{% load cancan_tags %}"
+            '{% prefetch_abilities object_list "change" %}'
+            "{% for article in object_list %}"
+            '{% if ability|can:"change"|subject:article %}{{ article.name }} {% endif %}'
+            "{% endfor %}"
+        )
+        context = Context(
+            {"ability": self.ability, "object_list": Article.objects.all()}
+        )
+        with self.assertNumQueries(2):
+            output = template.render(context)
+        self.assertEqual(output.strip(), "draft")
+
+    def test_prefetched_results_are_not_evicted(self):
+        ability = Ability(self.ability.access_rules, cache_size=2)
+        for i in range(5):
+            Article.objects.create(name=f"draft {i}")
+        template = Template(
+            "{% load cancan_tags %}"
+            '{% prefetch_abilities object_list "change" %}'
+            "{% for article in object_list %}"
+            '{% if ability|can:"change"|subject:article %}x{% endif %}'
+            "{% endfor %}"
+        )
+        context = Context({"ability": ability, "object_list": Article.objects.all()})
+        with self.assertNumQueries(2):
+            output = template.render(context)
+        self.assertEqual(output, "xxxxx")
+
+
+class LoadAbilitiesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        access_rules = AccessRules(user=self.user)
+        access_rules.allow("view", Article)
+        access_rules.allow("change", Article, name__contains="draft")
+        self.ability = Ability(access_rules)
+
+    def test_perms_by_pk(self):
+        draft = Article.objects.create(name="draft")
+        final = Article.objects.create(name="final")
+        template = Template(
+            "{% load cancan_tags %}"
+            '{% load_abilities object_list "view" "change" as perms %}'
+            "{% for article in object_list %}"
+            "{{ article.name }}:"
+            '{{ perms|get:article.pk|get:"view" }},'
+            '{{ perms|get:article.pk|get:"change" }} '
+            "{% endfor %}"
+        )
+        context = Context({"ability": self.ability, "object_list": [draft, final]})
+        with self.assertNumQueries(1):
+            output = template.render(context)
+        self.assertEqual(output.strip(), "draft:True,True final:True,False")
+
+    def test_can_filter_returns_new_checks(self):
+        article = Article.objects.create(name="final")
+        template = Template(
+            "{% load cancan_tags %}"
+            "{% with check=ability|subject:article %}"
+            '{% if check|can:"view" %}view {% endif %}'
+            '{% if check|can:"change" %}change {% endif %}'
+            "{% endwith %}"
+        )
+        output = template.render(Context({"ability": self.ability, "article": article}))
+        self.assertEqual(output.strip(), "view")
@@ -0,0 +1,48 @@
+from django.template import Context, Template
+from django.test import TestCase
+from cancan.testapp.models import Article, User
+from cancan.ability import Ability
+from cancan.access_rules import AccessRules
+from cancan.testing import assert_ability_queries
+
+
+class AssertAbilityQueriesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user1")
+        access_rules = AccessRules(user=self.user)
+        access_rules.allow("view", Article, name__contains="draft")
+        self.ability = Ability(access_rules)
+        self.articles = [Article.objects.create(name=f"draft {i}") for i in range(3)]
+
+    def test_queries_of_checks_are_counted(self):
+        with assert_ability_queries(max=1) as queries:
+            self.ability.can_many("view", self.articles)
+            # evaluated outside of ability checks
+            list(self.ability.queryset_for("view", Article))
+        self.assertEqual(len(queries), 1)
+
+    def test_too_many_queries(self):
+        with self.assertRaises(AssertionError):
+            with assert_ability_queries(max=2):
+                for article in self.articles:
+                    self.ability.can("view", article)
+
+    def test_repeated_checks_are_logged_with_call_site(self):
+        self.ability.warn_repeated = 2
+        with self.assertLogs("cancan.ability", "WARNING") as logs:
+            for article in self.articles:
+                self.ability.can("view", article)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("test_testing.py", logs.output[0])
+
+    def test_template_call_site(self):
+        self.ability.warn_repeated = 2
+        template = Template(
+            "{% load cancan_tags %}{% for article in object_list %}\n"
+            '{% if ability|can:"view"|subject:article %}x{% endif %}'
+            "{% endfor %}"
+        )
+        context = Context({"ability": self.ability, "object_list": self.articles})
+        with self.assertLogs("cancan.ability", "WARNING") as logs:
+            template.render(context)
+        self.assertIn("line 2", logs.output[0])
@@ -0,0 +1,84 @@
+"""
+Helpers for finding N+1 queries caused by ability checks, i. e.
+
+    with assert_ability_queries(max=1):
+        response = client.get("/projects/")
+"""
+
+import os
+import sys
+from contextlib import contextmanager
+from django.db import DEFAULT_DB_ALIAS, connections
+
+CANCAN_DIR = os.path.dirname(os.path.abspath(__file__))
+ABILITY_FILE = os.path.join(CANCAN_DIR, "ability.py")
+LIBRARY_DIRS = tuple(
+    os.path.dirname(os.path.abspath(module.__file__)) + os.sep
+    for module in (sys.modules["django"], sys.modules["asgiref"])
+)
+
+
+def is_library_file(filename):
+    filename = os.path.abspath(filename)
+    # tests of cancan live in a subpackage and are not a part of the library
+    if os.path.dirname(filename) in (
+        CANCAN_DIR,
+        os.path.join(CANCAN_DIR, "templatetags"),
+    ):
+        return True
+    return filename.startswith(LIBRARY_DIRS)
+
+
+def get_call_site(frame=None):
+    """
+    Returns the template line, or the first function outside of cancan and Django,
+    which caused the current ability check
+    """
+    frame = frame or sys._getframe(1)
+    call_site = None
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == "render_annotated":
+            node = frame.f_locals.get("self")
+            origin = getattr(node, "origin", None)
+            token = getattr(node, "token", None)
+            if origin is not None and token is not None:
+                return f"{origin.name}, line {token.lineno}"
+        if call_site is None and not is_library_file(code.co_filename):
+            call_site = f"{code.co_filename}:{frame.f_lineno} in {code.co_name}"
+        frame = frame.f_back
+    return call_site
+
+
+def is_ability_query():
+    frame = sys._getframe(1)
+    while frame is not None:
+        if os.path.abspath(frame.f_code.co_filename) == ABILITY_FILE:
+            return True
+        frame = frame.f_back
+    return False
+
+
+@contextmanager
+def assert_ability_queries(max=0, using=DEFAULT_DB_ALIAS):
+    """
+    Fails if ability checks within the block issued more than `max` queries.
+    Queries of querysets returned by `queryset_for` are not counted, as they are
+    evaluated by your code. Yields the list of counted SQL statements.
+    """
+    queries = []
+
+    def count_queries(execute, sql, params, many, context):
+        if is_ability_query():
+            queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connections[using].execute_wrapper(count_queries):
+        yield queries
+
+    if len(queries) > max:
+        statements = "\n".join(f"{i}. {sql}" for i, sql in enumerate(queries, start=1))
+        raise AssertionError(
+            f"{len(queries)} queries executed by ability checks, {max} expected at most\n"
+            f"{statements}"
+        )
@@ -5,6 +5,7 @@ from django.views.generic import ListView, DetailView, TemplateView
 from django.views.generic.edit import CreateView, UpdateView
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth.middleware import AuthenticationMiddleware
+from cancan.mixins import AbilityObjectMixin
 from .models import Project
 
 
@@ -22,15 +23,9 @@ class ProjectListView(UserPassesTestMixin, ListView):
         return self.request.ability.can("view", self.model)
 
 
-class ProjectDetailView(DetailView):
+class ProjectDetailView(AbilityObjectMixin, DetailView):
     model = Project
 
-    def get_queryset(self):
-        return self.request.ability.queryset_for("view", self.model)
-
-    def test_func(self):
-        return self.request.ability.can("view", self.get_object())
-
 
 class ProjectCreateView(UserPassesTestMixin, CreateView):
     model = Project
@@ -47,16 +42,14 @@ class ProjectCreateView(UserPassesTestMixin, CreateView):
         return reverse("project_detail", args=(self.object.id,))
 
 
-class ProjectUpdateView(UserPassesTestMixin, UpdateView):
+class ProjectUpdateView(AbilityObjectMixin, UpdateView):
     model = Project
     fields = ["name", "description"]
-
-    def test_func(self):
-        return self.request.ability.can("change", self.get_object())
+    ability_action = "change"
 
     def form_valid(self, form):
         form.instance.created_by = self.request.user
         return super().form_valid(form)
 
     def get_success_url(self):
-        return reverse("project_detail", args=(self.self.get_object().id,))
+        return reverse("project_detail", args=(self.object.id,))